@@ -1,8 +1,9 @@
 
 
 import hashlib
-import json
+import os
 import subprocess
+import sys
 import ast
 import glob
 from datetime import datetime, timedelta
@@ -11,6 +12,10 @@ import asyncio
 from db import DBService, PairGroup, Backtesting, StrategyPerformance
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from services.backtest_results import find_result_files, iter_strategy_results
+
 logging.basicConfig(level=logging.ERROR)
 
 def get_timerange(delta=2):
@@ -87,25 +92,13 @@ class BacktestingService:
 
 class AnalysisService:
     def __init__(self):
-        self.backtest_results = [f for f in glob.glob('./user_data/backtest_results/*.json') if not f.endswith('.meta.json')]
+        self.backtest_results = find_result_files('./user_data/backtest_results/')
         pass
 
     def run(self):
         results = []
         for result in self.backtest_results:
-            with open(result, 'r') as f:
-                data = json.load(f)
-                if not data:
-                    continue
-                summary = data.get('strategy', {})
-                
-                strategies = summary.keys()
-                for strategy in strategies:
-                    d = summary.get(strategy, {})
-                    results.append({
-                        'key': strategy,
-                        'details': d,
-                    })
+            results.extend(iter_strategy_results(result))
         return results
 
 
@@ -137,16 +130,12 @@ async def main():
     results = await backtester.run()
     analyzer = AnalysisService()
     results = analyzer.run()
+    strategy_ids = {strategy['name']: strategy['_id'] for strategy in s}
     p = []
     for r in results:
-        sid = None
-        for strategy in list(s):
-            if strategy['name'] == r['key']:
-                sid = strategy['_id']
-                break
         _details = r['details']
-        _pid = db.add_strategy_performance(StrategyPerformance(
-                strategy_id=sid,
+        p.append(StrategyPerformance(
+                strategy_id=strategy_ids.get(r['key']),
                 strategy_name=r['key'],
                 start_date=start_date,
                 end_date=end_date,
@@ -155,16 +144,15 @@ async def main():
                 draws=_details['draws'],
                 total_trades=_details['total_trades'],
                 trade_per_day=_details['trades_per_day'],
-                profit=_details['profit_total'],
+                profit=_details['profit_total_abs'],
                 final_balance=_details['final_balance'],
                 max_drawdown=_details['max_drawdown_abs'],
-                profit_percentage=_details['profit_factor'],
+                profit_percentage=_details['profit_total'] * 100,
                 win_rate=_details['winrate'],
+                profit_factor=_details['profit_factor'],
                 details=_details
             ))
-        p.append(_pid.inserted_id)
-    # print(p)
-    r = db.add_backtesting_result(backtesting_id=b.inserted_id, performances=p)
+    db.add_backtesting_performances(b.inserted_id, p)
     # print(results)
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 from dataclasses import asdict, dataclass
-from pymongo import MongoClient
+from datetime import datetime, timedelta, timezone
+from pymongo import MongoClient, ReturnDocument
 import os
 from bson.objectid import ObjectId
 
@@ -47,6 +48,7 @@ class StrategyPerformance:
     profit_percentage: float
     win_rate: float
     details: dict
+    profit_factor: float = 0
 
 
 class DBService:
@@ -86,11 +88,38 @@ class DBService:
     def get_pending_backtestings_to_process(self):
         return self.db.get_collection("backtestings").find({"status": "pending"})
 
-    def update_backtesting_status(self, backtesting_id: str, status: 'pending' or 'processing' or 'completed' or 'failed' = 'pending'):  # type: ignore # noqa: F821
+    def update_backtesting_status(self, backtesting_id: str, status: 'pending' or 'processing' or 'completed' or 'failed' = 'pending', claim: dict = None):  # type: ignore # noqa: F821
+        query = {"_id": ObjectId(backtesting_id)}
+        if claim:
+            query.update({"status": "processing", **claim})
         return self.db.get_collection("backtestings").update_one(
-            {"_id": ObjectId(backtesting_id)}, {"$set": {"status": status}}
+            query, {"$set": {"status": status}, "$unset": {"lease_expires_at": ""}}
         )
 
+    def claim_backtesting(self, worker_id: str, lease_seconds: int):
+        # Atomic, so a backtesting is only ever handed to one worker. Jobs whose
+        # worker stopped renewing the lease are claimed again.
+        now = datetime.now(timezone.utc)
+        return self.db.get_collection("backtestings").find_one_and_update(
+            {"$or": [
+                {"status": "pending"},
+                {"status": "processing", "lease_expires_at": {"$lt": now}},
+            ]},
+            {
+                "$set": {"status": "processing", "claimed_by": worker_id, "lease_expires_at": now + timedelta(seconds=lease_seconds)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("_id", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def renew_backtesting_lease(self, backtesting_id: str, worker_id: str, lease_seconds: int) -> bool:
+        result = self.db.get_collection("backtestings").update_one(
+            {"_id": ObjectId(backtesting_id), "status": "processing", "claimed_by": worker_id},
+            {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)}},
+        )
+        return result.matched_count == 1
+
     def get_pair_group(self, group_id: str):
         return self.db.get_collection("pair_groups").find_one({"_id": ObjectId(group_id)})
 
@@ -105,10 +134,45 @@ class DBService:
     def add_strategy_performance(self, performance: StrategyPerformance):
         return self.db.get_collection("strategy_performances").insert_one(asdict(performance))
 
+    def add_backtesting_performances(self, backtesting_id, performances: list[StrategyPerformance], timings: list[dict] = None, claim: dict = None):
+        """
+        One unordered bulk insert for the whole run, then complete the backtesting.
+        With a `claim` ({"claimed_by": ..., "attempts": ...} of the lease the run
+        was made under), a worker that lost its lease to another one persists
+        nothing and gets None back.
+        """
+        performance_ids = []
+        if performances:
+            result = self.db.get_collection("strategy_performances").insert_many(
+                [asdict(performance) for performance in performances], ordered=False
+            )
+            performance_ids = list(result.inserted_ids)
+        if not self.add_backtesting_result(backtesting_id, performance_ids, timings, claim):
+            print(f"Backtesting {backtesting_id} was claimed again by another worker, dropping these results")
+            if performance_ids:
+                self.db.get_collection("strategy_performances").delete_many({"_id": {"$in": performance_ids}})
+            return None
+        # Count each backtesting once in the leaderboard, atomically with the flag
+        rolled_up = self.db.get_collection("backtestings").find_one_and_update(
+            {"_id": ObjectId(backtesting_id), "rolled_up": {"$ne": True}},
+            {"$set": {"rolled_up": True}},
+            projection={"timeframe": 1, "pair_group_id": 1},
+        )
+        if rolled_up:
+            # Shared with the API server, needs server/ on sys.path like the other services imports
+            from services.leaderboard import rollup_performances
+            rollup_performances(self.db, rolled_up, [asdict(performance) for performance in performances])
+        return performance_ids
+
     def add_backtesting_result(
-        self, backtesting_id, performances: list[str]
-    ):
-        self.db.get_collection("backtestings").update_one(
-            {"_id": ObjectId(backtesting_id)}, {"$set": {"status": "completed", "performances": performances}}
+        self, backtesting_id, performances: list[str], timings: list[dict] = None, claim: dict = None
+    ) -> bool:
+        # Fenced on the claim when given: only the current lease holder completes the job
+        query = {"_id": ObjectId(backtesting_id)}
+        if claim:
+            query.update({"status": "processing", **claim})
+        result = self.db.get_collection("backtestings").update_one(
+            query,
+            {"$set": {"status": "completed", "performances": performances, "timings": timings or []}, "$unset": {"lease_expires_at": ""}}
         )
-        return backtesting_id
+        return result.matched_count == 1
@@ -1,18 +1,28 @@
 import asyncio
 from datetime import datetime
-import glob
 import hashlib
-import json
+import math
 import os
 import re
 from textwrap import dedent
-from time import sleep
+import time
 import uuid
 from dateutil.parser import parse
 import subprocess
 import shutil
+import socket
+import sys
+import threading
 from db import DBService, StrategyPerformance
-from multiprocessing import Process
+from pymongo.errors import PyMongoError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from services.candle_store import CandleStore
+from services.candle_downloader import IncrementalDownloader
+from services.backtest_results import find_result_files, read_strategy_results
+from services.trade_store import TradeWriter
+from services.indexes import ensure_indexes
 
 class DataDownloader:
     def __init__(self, pairlist, start_date: datetime, end_date: datetime):
@@ -20,37 +30,29 @@ class DataDownloader:
         self.start_date = start_date
         self.end_date = end_date
         self.config_filepath = "./user_data/backtest_config.json"
-        self.data_folder = "./user_data/data"
         self.log_filepath = "./user_data/logs/download_data.log"
-        self.queue = asyncio.Queue()
+        self.timeframes = ["1m", "5m", "15m"]
+        # Candles end up in ./user_data/data/binance, freqtrade's default datadir for this config
+        self.store = CandleStore(root="./user_data/data")
         pass
 
-    def build_download_command(self):
-        timerange = f"{self.start_date.strftime('%Y%m%d')}-{self.end_date.strftime('%Y%m%d')}"
-        pairs = " ".join([pair for pair in self.pairlist])
-
-        command = dedent(f"""
-            freqtrade download-data --exchange binance --timerange {timerange} 
-            --timeframe 1m 5m 15m -p {pairs} --config ./user_data/backtest_config.json
-            --include-inactive-pairs --trading-mode futures --log-file {self.log_filepath} --datadir {self.data_folder}
-        """).strip().replace("\n", " ")
-        command = re.sub(r"\s+", " ", command)
-        return command
-    
     def download_data(self):
-        command = self.build_download_command()
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-        process.wait()
-        pass
+        downloader = IncrementalDownloader(self.store, self.config_filepath, self.log_filepath)
+        return downloader.download(self.pairlist, self.timeframes, self.start_date, self.end_date)
 
 class ProcessBacktestingService:
-    def __init__(self, pairlist, strategies, start_date: datetime, end_date: datetime):
+    def __init__(self, pairlist, strategies, start_date: datetime, end_date: datetime, worker_num: int = None, trade_sink=None):
         self.strategies = strategies
         self.pairlist = pairlist
         self.start_date = start_date
         self.end_date = end_date
+        # Each worker runs its own freqtrade process, so default to one per core
+        self.worker_num = worker_num or int(os.environ.get("BACKTEST_WORKERS", os.cpu_count() or 1))
         self.queue = asyncio.Queue()
         self.results = []
+        self.timings = []
+        # Called with (strategy, trade) for every exported trade before the results are removed
+        self.trade_sink = trade_sink
         pass
 
     async def worker(self, name):
@@ -63,27 +65,18 @@ class ProcessBacktestingService:
                 break
             command = self.build_backtesting_command(strategies, name, result_folder)
 
+            started = time.time()
             process = await asyncio.create_subprocess_shell(
                 command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
             )
             await process.communicate()
+            seconds = round(time.time() - started, 2)
+            print(f"{name} backtested {len(strategies)} strategies in {seconds}s")
+            self.timings.append({'worker': name, 'strategies': strategies, 'seconds': seconds})
             self.queue.task_done()
-        # Analyze the results
-        result_files = [f for f in glob.glob(f'{result_folder}/*.json') if not f.endswith('.meta.json')]
-        for result in result_files:
-            with open(result, 'r') as f:
-                data = json.load(f)
-                if not data:
-                    continue
-                summary = data.get('strategy', {})
-                
-                strategies = summary.keys()
-                for strategy in strategies:
-                    d = summary.get(strategy, {})
-                    self.results.append({
-                        'key': strategy,
-                        'details': d,
-                    })
+        # Analyze the results, one result file per shard
+        for result in find_result_files(f'{result_folder}result'):
+            self.results.extend(read_strategy_results(result, self.trade_sink))
         # Remove the result folder
         shutil.rmtree(result_folder)
         pass
@@ -110,8 +103,9 @@ class ProcessBacktestingService:
         return command
 
     async def run(self):
-        batch_size = 1
-        worker_num = 1
+        worker_num = max(1, min(self.worker_num, len(self.strategies)))
+        # One shard of strategies per worker
+        batch_size = max(1, math.ceil(len(self.strategies) / worker_num))
         batches = [self.strategies[i : i + batch_size] for i in range(0, len(self.strategies), batch_size)]
         for batch in batches:
             self.queue.put_nowait(batch)
@@ -122,9 +116,10 @@ class ProcessBacktestingService:
         await asyncio.gather(*tasks)
         return self.results
 
-async def process_backtesting(db: DBService, backtesting):
+async def process_backtesting(db: DBService, backtesting, worker_id: str = None):
+    # Results are only persisted under the lease this run was claimed with
+    claim = {'claimed_by': worker_id, 'attempts': backtesting.get('attempts')} if worker_id else None
     try: 
-        db.update_backtesting_status(str(backtesting.get('_id')), "processing")
         pairgroup = db.get_pair_group(str(backtesting.get('pair_group_id')))
         pairlist = pairgroup.get('pairs', [])
 
@@ -136,66 +131,124 @@ async def process_backtesting(db: DBService, backtesting):
         end_date = parse(backtesting.get('end_date'))
 
         downloader = DataDownloader(pairlist, start_date, end_date)
-        downloader.download_data()
+        await asyncio.to_thread(downloader.download_data)
 
-        backtesting_service = ProcessBacktestingService(pairlist, strategies, start_date, end_date)
+        strategy_ids = {strategy['name']: strategy['_id'] for strategy in strategies_r}
+        trade_writer = TradeWriter(db.db, str(backtesting.get('_id')), strategy_ids)
+        backtesting_service = ProcessBacktestingService(pairlist, strategies, start_date, end_date, trade_sink=trade_writer)
         results = await backtesting_service.run()
+        trade_writer.flush()
         
         performances = []
         for result in results:
-            sid = None
-            for strategy in strategies_r:
-                if strategy['name'] == result['key']:
-                    sid = strategy['_id']
-                    break
             _details = result['details']
-            _pid = db.add_strategy_performance(StrategyPerformance(   
-                    strategy_id=sid,
-                    strategy_name=result['key'],
-                    start_date=start_date,
-                    end_date=end_date,
-                    wins=_details['wins'],
-                    losses=_details['losses'],
-                    draws=_details['draws'],
-                    total_trades=_details['total_trades'],
-                    trade_per_day=_details['trades_per_day'],
-                    profit=_details['profit_total'],
-                    final_balance=_details['final_balance'],
-                    max_drawdown=_details['max_drawdown_abs'],
-                    profit_percentage=_details['profit_factor'],
-                    win_rate=_details['winrate'],
-                    details=_details
-                ))
-            performances.append(_pid.inserted_id)
-        db.add_backtesting_result(backtesting_id=str(backtesting.get('_id')), performances=performances)
+            performances.append(StrategyPerformance(
+                strategy_id=strategy_ids.get(result['key']),
+                strategy_name=result['key'],
+                start_date=start_date,
+                end_date=end_date,
+                wins=_details['wins'],
+                losses=_details['losses'],
+                draws=_details['draws'],
+                total_trades=_details['total_trades'],
+                trade_per_day=_details['trades_per_day'],
+                profit=_details['profit_total_abs'],
+                final_balance=_details['final_balance'],
+                max_drawdown=_details['max_drawdown_abs'],
+                profit_percentage=_details['profit_total'] * 100,
+                win_rate=_details['winrate'],
+                profit_factor=_details['profit_factor'],
+                details=_details
+            ))
+        db.add_backtesting_performances(str(backtesting.get('_id')), performances, timings=backtesting_service.timings, claim=claim)
     except Exception as e:
-        db.update_backtesting_status(str(backtesting.get('_id')), "failed")
+        db.update_backtesting_status(str(backtesting.get('_id')), "failed", claim=claim)
         print(f"Failed to process backtesting {backtesting.get('_id')}: {e}")
 
+class BacktestingScheduler:
+    """
+    Long-running loop claiming pending backtestings, at most `max_concurrency`
+    at a time. A claim is a lease on the backtesting document renewed by a
+    heartbeat, if this process dies the lease expires and the job is claimed
+    again by another scheduler. New jobs are picked up from a change stream,
+    standalone MongoDB servers without change streams fall back to polling.
+    """
+
+    def __init__(self, db: DBService, max_concurrency: int = None, lease_seconds: int = None, poll_seconds: int = None):
+        self.db = db
+        self.max_concurrency = max_concurrency or int(os.environ.get("BACKTEST_CONCURRENCY", 1))
+        self.lease_seconds = lease_seconds or int(os.environ.get("BACKTEST_LEASE_SECONDS", 300))
+        self.poll_seconds = poll_seconds or int(os.environ.get("BACKTEST_POLL_SECONDS", 30))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.running = set()
+        self.change_stream = True
+        self.wakeup = None
+
+    def watch(self, loop: asyncio.AbstractEventLoop):
+        # Runs in its own thread, wakes the loop on new or re-queued backtestings only
+        pipeline = [{"$match": {"$or": [
+            {"operationType": "insert"},
+            {"updateDescription.updatedFields.status": "pending"},
+        ]}}]
+        try:
+            with self.db.db.get_collection("backtestings").watch(pipeline) as stream:
+                for _ in stream:
+                    loop.call_soon_threadsafe(self.wakeup.set)
+        except PyMongoError as e:
+            print(f"Change stream unavailable, polling every {self.poll_seconds}s: {e}")
+        self.change_stream = False
+        loop.call_soon_threadsafe(self.wakeup.set)
+
+    def heartbeat(self, backtesting_id: str, stop: threading.Event):
+        # A thread rather than a task: parts of a job block the event loop
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.db.renew_backtesting_lease(backtesting_id, self.worker_id, self.lease_seconds):
+                print(f"Lost the lease on backtesting {backtesting_id}")
+                return
+
+    async def run_job(self, backtesting):
+        backtesting_id = str(backtesting.get('_id'))
+        stop = threading.Event()
+        threading.Thread(target=self.heartbeat, args=(backtesting_id, stop), daemon=True).start()
+        try:
+            print(f"{self.worker_id} processing backtesting {backtesting_id} (attempt {backtesting.get('attempts', 1)})")
+            await process_backtesting(self.db, backtesting, self.worker_id)
+        finally:
+            stop.set()
+            self.wakeup.set()
+
+    async def run(self, once: bool = False):
+        """
+        With `once`, return as soon as nothing is left to claim or running.
+        """
+        loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        await asyncio.to_thread(ensure_indexes, self.db.db)
+        if once:
+            self.change_stream = False
+        else:
+            threading.Thread(target=self.watch, args=(loop,), daemon=True).start()
+        while True:
+            self.wakeup.clear()
+            while len(self.running) < self.max_concurrency:
+                backtesting = await asyncio.to_thread(self.db.claim_backtesting, self.worker_id, self.lease_seconds)
+                if not backtesting:
+                    break
+                task = asyncio.create_task(self.run_job(backtesting))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+            if once and not self.running:
+                return
+            # Expired leases don't show up in the change stream, look for them once per lease
+            timeout = self.lease_seconds if self.change_stream else self.poll_seconds
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
 async def main():
-    db = DBService()
-    backtestings  = list(db.get_pending_backtestings_to_process())
-    if not backtestings:
-        return
-    
-    ####################
-    # TEST CODE #
-    # test_b = backtestings[0]    
-    # await process_backtesting(db, test_b)
-    # END TEST CODE #
-    ####################
-    tasks = []
-    for backtesting in backtestings:
-        task = asyncio.create_task(process_backtesting(db, backtesting))
-        tasks.append(task)
-    await asyncio.gather(*tasks)
-
-def loop_main():
-    asyncio.run(main())
+    await BacktestingScheduler(DBService()).run(once=True)
 
 if __name__ == "__main__":
     print("Starting backtesting process...")
-    while True:
-        p = Process(target=loop_main)
-        p.start()
-        sleep(5)
+    asyncio.run(BacktestingScheduler(DBService()).run())
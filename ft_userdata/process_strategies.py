@@ -1,6 +1,8 @@
+import asyncio
 import os
+import sys
+from datetime import datetime, timezone
 from textwrap import dedent
-from time import sleep
 from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import SystemMessage, HumanMessage
 import glob
@@ -9,12 +11,21 @@ from db import DBService, Strategy
 import ast
 from pydantic import BaseModel
 from typing import List
-from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from services.llm_pipeline import (
+    ANALYSIS_CACHE_COLLECTION, CHECKPOINT_COLLECTION, AnalysisCache, AnalysisPipeline, is_rate_limit_error,
+)
+
+# Part of the analysis cache key, bump it whenever the prompt below changes
+PROMPT_VERSION = "verify-strategy-v1"
 
 class ProcessStrategies:
     def __init__(self):
         ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
         model_name = "claude-3-sonnet-20240229"
+        self.model_name = model_name
         self.llm = ChatAnthropic(model_name=model_name, api_key=ANTHROPIC_API_KEY)
         
         class StrategyResponse(BaseModel):
@@ -56,11 +67,13 @@ class ProcessStrategies:
                 result = result.model_dump()
                 break  # If no exception is raised, break the loop
             except Exception as e:
+                # Quota errors are retried with backoff by the pipeline
+                if is_rate_limit_error(e):
+                    raise
                 print(e)
                 result = default_result  # Set the result to the default value
                 if i == max_retries - 1:  # If this was the last retry, return the default result
                     break
-                sleep(1)  # Sleep for 1 second before retrying
         
         return result
 
@@ -80,21 +93,34 @@ def main():
     ps = ProcessStrategies()
     strategies = [f for f in glob.glob('./user_data/strategies/*.py')]
     db = DBService()
-    for strategy in tqdm(strategies[30:]):
+    strategy_codes = {}
+    for strategy in strategies:
         with open(strategy, 'r', encoding='utf-8') as f:
-            strategy_code = f.read()
-            result = ps.verify_strategy(strategy_code)
-            db.add_strategy(Strategy(
-                name=get_strategy_name(strategy),
-                filename=os.path.basename(strategy),
-                code=strategy_code,
-                indicators=result.get('Indicators', []),
-                explanation=result.get('Explanation', ''),
-                example=result.get('Example', ''),
-                description=result.get('Analyze', ''),
-                analysis=result
-            ))
-        sleep(5)
+            strategy_codes[strategy] = f.read()
+
+    def save_strategy(strategy: str, result: dict):
+        db.add_strategy(Strategy(
+            name=get_strategy_name(strategy),
+            filename=os.path.basename(strategy),
+            code=strategy_codes[strategy],
+            indicators=result.get('Indicators', []),
+            explanation=result.get('Explanation', ''),
+            example=result.get('Example', ''),
+            description=result.get('Analyze', ''),
+            analysis=result
+        ))
+
+    # A fresh run every time, an interrupted run is resumed by passing its id as ANALYSIS_RUN_ID
+    run_id = os.environ.get('ANALYSIS_RUN_ID') or f"process_strategies_{datetime.now(timezone.utc):%Y%m%dT%H%M%S}"
+    print(f"Analysis run {run_id}")
+    pipeline = AnalysisPipeline(
+        ps.verify_strategy,
+        db.db.get_collection(CHECKPOINT_COLLECTION),
+        run_id=run_id,
+        cache=AnalysisCache(db.db.get_collection(ANALYSIS_CACHE_COLLECTION), PROMPT_VERSION, ps.model_name),
+    )
+    report = asyncio.run(pipeline.run(strategy_codes, save_strategy))
+    print(report)
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,4 +1,5 @@
 
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,10 +7,22 @@ from routes.backtesting import router as backtesting_router
 from routes.pairs import router as pair_groups_router
 from routes.strategies import router as strategies_router
 from routes.strategy_groups import router as strategy_groups_router
+from routes.leaderboard import router as leaderboard_router
+from db import get_db, ping_db, close_db, close_async_db
+from services.indexes import ensure_indexes
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ping_db()
+    ensure_indexes(get_db())
+    yield
+    await close_async_db()
+    close_db()
 
 app = FastAPI(
     debug=True,
     title="Freqtrade API",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -24,6 +37,7 @@ app.include_router(backtesting_router, prefix="/backtestings", tags=["backtestin
 app.include_router(pair_groups_router, prefix="/pair-groups", tags=["pair groups"])
 app.include_router(strategies_router, prefix="/strategies", tags=["strategies"])
 app.include_router(strategy_groups_router, prefix="/strategy-groups", tags=["strategy groups"])
+app.include_router(leaderboard_router, prefix="/leaderboard", tags=["leaderboard"])
 
 @app.get("/")
 async def root():
@@ -0,0 +1,110 @@
+"""
+Checks strategy_helpers.conditions against the condition_maker
+HyperStra_GSN_SMAOnly used, with its Normalizer swapped for the causal one,
+and times both:
+python server/benchmarks/conditions.py
+"""
+import os
+import sys
+import time
+from functools import reduce
+
+import numpy as np
+from pandas import DataFrame, Series
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "strategies"))
+
+from strategy_helpers.conditions import NORMALIZED_SUFFIX, OPERATORS, all_conditions, normalize
+
+
+def crossed_above(s1: Series, s2: Series) -> Series:
+    # qtpylib.crossed_above
+    return (s1 > s2) & (s1.shift(1) <= s2.shift(1))
+
+
+def crossed_below(s1: Series, s2: Series) -> Series:
+    # qtpylib.crossed_below
+    return (s1 < s2) & (s1.shift(1) >= s2.shift(1))
+
+
+def condition_maker(dataframe: DataFrame, indicator_1: str, indicator_2: str, real_number: float, operator: str) -> Series:
+    if operator == "equal":
+        return dataframe[indicator_1] == dataframe[indicator_2]
+    if operator == "above":
+        return dataframe[indicator_1] >= dataframe[indicator_2]
+    if operator == "below":
+        return dataframe[indicator_1] <= dataframe[indicator_2]
+    if operator == "cross_above":
+        return crossed_above(dataframe[indicator_1], dataframe[indicator_2])
+    if operator == "cross_below":
+        return crossed_below(dataframe[indicator_1], dataframe[indicator_2])
+    if operator == "divide_greater":
+        return dataframe[indicator_1].div(dataframe[indicator_2]) <= real_number
+    if operator == "divide_smaller":
+        return dataframe[indicator_1].div(dataframe[indicator_2]) >= real_number
+    if operator == "normalized_equal_n":
+        return normalize(dataframe[indicator_1]) == real_number
+    if operator == "normalized_smaller_n":
+        return normalize(dataframe[indicator_1]) < real_number
+    if operator == "normalized_bigger_n":
+        return normalize(dataframe[indicator_1]) > real_number
+    if operator == "normalized_devided_equal_n":
+        return normalize(dataframe[indicator_1]).div(normalize(dataframe[indicator_2])) == real_number
+    if operator == "normalized_devided_smaller_n":
+        return normalize(dataframe[indicator_1]).div(normalize(dataframe[indicator_2])) < real_number
+    if operator == "normalized_devided_bigger_n":
+        return normalize(dataframe[indicator_1]).div(normalize(dataframe[indicator_2])) > real_number
+
+
+def moving_averages(candles: int, periods: list[int], rng) -> DataFrame:
+    # A coarse price grid gives ties, equal MAs and normalized values of exactly 0 and 1
+    close = Series(np.round(100 + rng.standard_normal(candles).cumsum(), 0))
+    dataframe = DataFrame({f"ma_{period}": close.rolling(period).mean().round(0) for period in periods})
+    dataframe["ma_zero"] = np.where(rng.random(candles) < 0.05, 0.0, dataframe[f"ma_{periods[0]}"])
+    for column in list(dataframe.columns):
+        dataframe[f"{column}{NORMALIZED_SUFFIX}"] = normalize(dataframe[column])
+    return dataframe
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    # 90 days of 5m candles
+    dataframe = moving_averages(90 * 288, [5, 20, 50, 200], rng)
+    columns = [column for column in dataframe.columns if not column.endswith(NORMALIZED_SUFFIX)]
+
+    # normalize only looks back: the prefix of a series scales the same alone
+    values = dataframe["ma_50"]
+    for length in [300, 5000, len(values)]:
+        assert normalize(values[:length]).equals(normalize(values)[:length]), length
+
+    # Every operator, on every pair of columns and a few real numbers including exact hits
+    checked = 0
+    for operator in OPERATORS:
+        for column in columns:
+            for column_sec in columns:
+                for real_number in [0.0, 0.5, 1.0, 1.01]:
+                    expected = condition_maker(dataframe, column, column_sec, real_number, operator)
+                    actual = all_conditions(dataframe, [(operator, column, column_sec, real_number)])
+                    assert actual.equals(expected.fillna(False).astype(bool)), (operator, column, column_sec, real_number)
+                    checked += 1
+    print(f"{len(OPERATORS)} operators, {checked} single conditions identical")
+
+    # Full signals of random 3 condition sides, timed the way a hyperopt epoch evaluates them
+    sides = [
+        [(rng.choice(list(OPERATORS)), rng.choice(columns), rng.choice(columns), float(rng.choice([0.2, 0.5, 0.8, 1.0])))
+         for _ in range(3)]
+        for _ in range(200)
+    ]
+    start = time.perf_counter()
+    expected = [
+        reduce(lambda x, y: x & y, [condition_maker(dataframe, column, column_sec, real_number, operator)
+                                    for operator, column, column_sec, real_number in side])
+        for side in sides
+    ]
+    loop_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = [all_conditions(dataframe, side) for side in sides]
+    vectorized_seconds = time.perf_counter() - start
+    assert all(a.equals(e.fillna(False).astype(bool)) for a, e in zip(actual, expected))
+    print(f"{len(sides)} sides of 3 conditions identical, condition_maker {loop_seconds:.2f}s, "
+          f"all_conditions {vectorized_seconds:.2f}s (normalization precomputed)")
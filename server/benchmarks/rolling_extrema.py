@@ -0,0 +1,54 @@
+"""
+Checks strategy_helpers.rolling_extrema against the windowed argrelextrema
+loop Minmax used, and times both:
+python server/benchmarks/rolling_extrema.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from pandas import Series
+from scipy.signal import argrelextrema
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "strategies"))
+
+from strategy_helpers.rolling_extrema import penultimate_extrema
+
+
+def windowed_argrelextrema(close: np.ndarray, frame_size: int, order: int):
+    buy = np.zeros(len(close), dtype=bool)
+    sell = np.zeros(len(close), dtype=bool)
+    for i in range(len(close)):
+        if i + frame_size < len(close):
+            window = close[i : i + frame_size]
+            min_peaks = argrelextrema(window, np.less, order=order)
+            max_peaks = argrelextrema(window, np.greater, order=order)
+            if len(min_peaks[0]) and min_peaks[0][-1] == frame_size - 2:
+                buy[i + frame_size] = True
+            if len(max_peaks[0]) and max_peaks[0][-1] == frame_size - 2:
+                sell[i + frame_size] = True
+    return buy, sell
+
+
+def signals(close: Series, frame_size: int, order: int):
+    minima, maxima = penultimate_extrema(close, order)
+    warmup = np.arange(len(close)) >= frame_size
+    return (minima.shift(1, fill_value=False) & warmup).values, (maxima.shift(1, fill_value=False) & warmup).values
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    # 90 days of 5m candles, a coarse price grid gives plenty of ties
+    close = Series(np.round(100 + rng.standard_normal(90 * 288).cumsum(), 1))
+    close[1000:1010] = np.nan
+    for frame_size, order in [(500, 100), (50, 5), (20, 1)]:
+        start = time.perf_counter()
+        expected = windowed_argrelextrema(close.values, frame_size, order)
+        loop_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = signals(close, frame_size, order)
+        vectorized_seconds = time.perf_counter() - start
+        assert all((a == e).all() for a, e in zip(actual, expected)), (frame_size, order)
+        print(f"frame_size={frame_size} order={order}: {expected[0].sum()} buys, {expected[1].sum()} sells, "
+              f"argrelextrema loop {loop_seconds:.2f}s, vectorized {vectorized_seconds * 1000:.1f}ms")
@@ -1,27 +1,95 @@
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient
 import os
+import threading
 from langchain_anthropic import ChatAnthropic
 from langchain_openai import ChatOpenAI
 from langchain_core.language_models import BaseChatModel
 
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_TIMEOUT_MS = int(os.environ.get('MONGO_TIMEOUT_MS', 5000))
+# zlib ships with Python, zstd / snappy need their own packages
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', 'zlib')
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_async_client = None
+
+def _client_options() -> dict:
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_TIMEOUT_MS,
+        "compressors": MONGO_COMPRESSORS,
+    }
+
+def _connection_string() -> str:
+    CONNECTION_STRING = os.environ.get('MONGO_CONNECTION_STRING')
+    if not CONNECTION_STRING:
+        print("MongoDB connection string not found")
+        raise Exception("MongoDB connection string not found")
+    return CONNECTION_STRING
+
+def _db_name() -> str:
+    DB_NAME = os.environ.get('MONGO_DB_NAME')
+    if not DB_NAME:
+        print("MongoDB database name not found")
+        raise Exception("MongoDB database name not found")
+    return DB_NAME
+
+def get_client() -> MongoClient:
+    """
+    One MongoClient per process, its connection pool is shared by every
+    request and task. Recreated after a fork (celery prefork workers), since
+    a client must not be used across processes.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(_connection_string(), **_client_options())
+                _client_pid = os.getpid()
+    return _client
+
 def get_db():
-    # Try to use real MongoDB first, fallback to mock database
+    return get_client().get_database(_db_name())
+
+def get_async_client() -> AsyncMongoClient:
+    """
+    Client of the API's event loop, the routes await their queries on it
+    instead of blocking a threadpool worker.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncMongoClient(_connection_string(), **_client_options())
+    return _async_client
+
+async def get_async_db():
+    return get_async_client().get_database(_db_name())
+
+def ping_db():
+    # Health check, once at startup instead of on every request
     try:
-        CONNECTION_STRING = os.environ.get('MONGO_CONNECTION_STRING')
-        DB_NAME = os.environ.get('MONGO_DB_NAME')
-        
-        if CONNECTION_STRING and DB_NAME:
-            client = MongoClient(CONNECTION_STRING)
-            # Test connection
-            client.admin.command('ping')
-            return client.get_database(DB_NAME)
-        else:
-            print("MongoDB connection string not found")
-            raise Exception("MongoDB connection string not found")
+        get_client().admin.command('ping')
     except Exception as e:
         print(f"Failed to connect to MongoDB: {e}")
         raise e
 
+def close_db():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+async def close_async_db():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
 def get_ai(model='anthropic') -> BaseChatModel:
     if model == 'anthropic':
         ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
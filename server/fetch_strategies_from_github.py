@@ -8,185 +8,95 @@ import os
 import subprocess
 import shutil
 import re
-import ast
-from typing import List, Dict, Optional, Set
-from pathlib import Path
+from typing import List, Dict, Optional
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from pymongo import DeleteMany, UpdateOne
+
 from db import get_db
+from services.git_sync import RepoChanges, diff_mirror, flat_changes, get_synced_commit, set_synced_commit, update_mirror
+from services.strategy_metadata import StrategyMetadata, scan_strategies
 
-def clone_strategies_repo(temp_dir: str = "temp_strategies") -> bool:
-    """
-    Clone the freqtrade strategies repository
-    """
-    try:
-        # Remove existing temp directory if it exists
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        
-        print("Cloning freqtrade-strategies repository...")
-        
-        # Clone the repository with shallow clone to reduce .git folder size
-        result = subprocess.run([
-            "git", "clone", "-b", "migrate-2024", "--depth", "1",
-            "https://github.com/MaoBui2907/freqtrade-strategies.git", 
-            temp_dir
-        ], capture_output=True, text=True, timeout=60)
-        
-        if result.returncode != 0:
-            print(f"Failed to clone repository: {result.stderr}")
-            return False
-        
-        print("Successfully cloned repository")
-        return True
-        
-    except subprocess.TimeoutExpired:
-        print("Repository cloning timed out")
-        return False
-    except Exception as e:
-        print(f"Error cloning repository: {e}")
-        return False
+REPO_URL = "https://github.com/MaoBui2907/freqtrade-strategies.git"
+REPO_BRANCH = "migrate-2024"
+SYNC_KEY = "fetch_strategies_from_github"
 
-def extract_strategy_info(file_path: str) -> Optional[Dict]:
+def sync_strategies_repo(mirror_dir: str = "strategies_mirror", full: bool = False) -> Optional[RepoChanges]:
     """
-    Extract strategy information from Python file
+    Fetch the freqtrade strategies repository into a persistent mirror and
+    return the strategy files changed since the last synced commit
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Parse the AST to extract information
-        try:
-            tree = ast.parse(content)
-        except SyntaxError:
-            print(f"Syntax error in {file_path}, skipping...")
-            return None
-        
-        strategy_info = {
-            'filename': os.path.basename(file_path),
-            'name': os.path.splitext(os.path.basename(file_path))[0],
-            'description': '',
-            'explanation': '',
-            'indicators': [],
-            'example': '',
-            'content': content
-        }
-        
-        # Extract class name and docstring
-        for node in ast.walk(tree):
-            if isinstance(node, ast.ClassDef):
-                # Use class name as strategy name if it looks like a strategy
-                if any(keyword in node.name.lower() for keyword in ['strategy', 'strat']):
-                    strategy_info['name'] = node.name
-                
-                # Extract class docstring
-                if (node.body and isinstance(node.body[0], ast.Expr) and 
-                    isinstance(node.body[0].value, ast.Constant) and 
-                    isinstance(node.body[0].value.value, str)):
-                    docstring = node.body[0].value.value.strip()
-                    if docstring:
-                        strategy_info['description'] = docstring[:200] + ('...' if len(docstring) > 200 else '')
-                        strategy_info['explanation'] = docstring
-        
-        # Extract indicators from imports and function calls
-        indicators = set()
-        
-        # Common freqtrade indicators
-        common_indicators = {
-            'sma', 'ema', 'rsi', 'macd', 'bollinger', 'stoch', 'adx', 'cci', 'williams',
-            'atr', 'obv', 'mfi', 'trix', 'kama', 'tema', 'dema', 'mama', 'ht_trendline',
-            'ht_dcperiod', 'ht_dcphase', 'ht_phasor', 'ht_sine', 'ht_trendmode',
-            'sarext', 'sar', 'ppo', 'roc', 'rocp', 'rocr', 'rocr100', 'mom', 'cmo',
-            'plus_di', 'plus_dm', 'minus_di', 'minus_dm', 'dx', 'willr', 'ultosc',
-            'bop', 'cci', 'cmo', 'dx', 'mfi', 'minus_di', 'minus_dm', 'mom', 'plus_di',
-            'plus_dm', 'ppo', 'roc', 'rocp', 'rocr', 'rocr100', 'rsi', 'trix', 'ultosc',
-            'willr', 'ad', 'adosc', 'obv', 'ht_dcperiod', 'ht_dcphase', 'ht_phasor',
-            'ht_sine', 'ht_trendline', 'ht_trendmode'
-        }
-        
-        # Search for indicator usage in content
-        content_lower = content.lower()
-        for indicator in common_indicators:
-            if indicator in content_lower:
-                indicators.add(indicator.upper())
-        
-        # Look for talib imports
-        talib_pattern = r'talib\.(\w+)'
-        talib_matches = re.findall(talib_pattern, content, re.IGNORECASE)
-        for match in talib_matches:
-            indicators.add(match.upper())
-        
-        # Look for qtpylib imports
-        qtpylib_pattern = r'qtpylib\.(\w+)'
-        qtpylib_matches = re.findall(qtpylib_pattern, content, re.IGNORECASE)
-        for match in qtpylib_matches:
-            indicators.add(match.upper())
-        
-        strategy_info['indicators'] = sorted(list(indicators))
-        
-        # Generate example based on strategy name and indicators
-        if strategy_info['indicators']:
-            top_indicators = strategy_info['indicators'][:3]
-            strategy_info['example'] = f"Strategy using {', '.join(top_indicators)} indicators"
-        else:
-            strategy_info['example'] = f"Custom trading strategy: {strategy_info['name']}"
-        
-        # Use filename as fallback description
-        if not strategy_info['description']:
-            name_parts = re.findall(r'[A-Z][a-z]*', strategy_info['name'])
-            if name_parts:
-                strategy_info['description'] = ' '.join(name_parts) + ' trading strategy'
-            else:
-                strategy_info['description'] = f"{strategy_info['name']} trading strategy"
-        
-        return strategy_info
-        
+        head = update_mirror(REPO_URL, REPO_BRANCH, mirror_dir)
+        base = None if full else get_synced_commit(get_db(), SYNC_KEY)
+        return diff_mirror(mirror_dir, "filtered", base, head)
+    except subprocess.TimeoutExpired:
+        print("Repository sync timed out")
+        return None
     except Exception as e:
-        print(f"Error processing {file_path}: {e}")
+        print(f"Error syncing repository: {e}")
         return None
 
-def find_strategy_files(repo_dir: str) -> List[str]:
+def extract_strategy_info(file_path: str, metadata: StrategyMetadata) -> Optional[Dict]:
     """
-    Find all Python strategy files in the filtered directory
+    Build the strategy document from the metadata scanned from its file
     """
-    strategy_files = []
-    filtered_path = os.path.join(repo_dir, "filtered")
+    if metadata.error:
+        print(f"Error processing {file_path}: {metadata.error}, skipping...")
+        return None
     
-    if not os.path.exists(filtered_path):
-        print(f"Filtered directory not found in {repo_dir}")
-        return strategy_files
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
     
-    for root, dirs, files in os.walk(filtered_path):
-        for file in files:
-            if file.endswith('.py') and not file.startswith('__'):
-                file_path = os.path.join(root, file)
-                strategy_files.append(file_path)
+    strategy_info = {
+        'filename': metadata.filename,
+        # Backtests copy strategies/{name}.py, the name is always the file stem
+        'name': os.path.splitext(metadata.filename)[0],
+        'class_name': metadata.class_name,
+        'description': '',
+        'explanation': metadata.docstring,
+        'indicators': metadata.indicators,
+        'example': '',
+        'is_strategy': metadata.is_strategy,
+        'timeframe': metadata.attributes.get('timeframe'),
+        'startup_candle_count': metadata.attributes.get('startup_candle_count', 0),
+        'content': content
+    }
+    if metadata.docstring:
+        strategy_info['description'] = metadata.docstring[:200] + ('...' if len(metadata.docstring) > 200 else '')
     
-    print(f"Found {len(strategy_files)} filtered strategy files")
-    return strategy_files
+    # Generate example based on strategy name and indicators
+    if strategy_info['indicators']:
+        top_indicators = strategy_info['indicators'][:3]
+        strategy_info['example'] = f"Strategy using {', '.join(top_indicators)} indicators"
+    else:
+        strategy_info['example'] = f"Custom trading strategy: {strategy_info['name']}"
+    
+    # Use filename as fallback description
+    if not strategy_info['description']:
+        name_parts = re.findall(r'[A-Z][a-z]*', strategy_info['name'])
+        if name_parts:
+            strategy_info['description'] = ' '.join(name_parts) + ' trading strategy'
+        else:
+            strategy_info['description'] = f"{strategy_info['name']} trading strategy"
+    
+    return strategy_info
 
-def copy_strategies_to_server(strategy_files: List[str], server_strategies_dir: str = "strategies") -> int:
+def copy_strategies_to_server(strategy_files: List[str], deleted_files: List[str], server_strategies_dir: str = "strategies") -> int:
     """
-    Copy strategy files to server strategies directory for backtesting
-    Returns number of files copied
+    Copy changed strategy files to server strategies directory for backtesting
+    and remove the deleted ones. Returns number of files copied
     """
-    if not strategy_files:
-        print("No strategy files to copy")
-        return 0
-    
     try:
-        # Create server strategies directory if it doesn't exist
         os.makedirs(server_strategies_dir, exist_ok=True)
         
-        # Clear existing strategy files
-        for existing_file in os.listdir(server_strategies_dir):
-            if existing_file.endswith('.py'):
-                os.remove(os.path.join(server_strategies_dir, existing_file))
-        
-        print(f"Cleared existing strategy files in {server_strategies_dir}")
+        for filename in deleted_files:
+            dest_path = os.path.join(server_strategies_dir, filename)
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+                print(f"Removed: {filename}")
         
-        # Copy new strategy files
         copied_count = 0
         for file_path in strategy_files:
             filename = os.path.basename(file_path)
@@ -203,32 +113,30 @@ def copy_strategies_to_server(strategy_files: List[str], server_strategies_dir:
         print(f"Error copying strategy files: {e}")
         return 0
 
-def insert_strategies_to_database(strategies: List[Dict]) -> int:
+def apply_strategies_to_database(strategies: List[Dict], deleted_files: List[str]) -> bool:
     """
-    Insert strategies into database
-    Returns number of strategies inserted
+    Upsert changed strategies by name and delete the removed ones, the ids of
+    unchanged and updated strategies stay the same
     """
-    if not strategies:
-        print("No strategies to insert")
-        return 0
-    
     try:
         db = get_db()
-        
-        # Clear existing strategies
-        delete_result = db.strategies.delete_many({})
-        print(f"Cleared {delete_result.deleted_count} existing strategies")
-        
-        # Insert new strategies
-        insert_result = db.strategies.insert_many(strategies)
-        inserted_count = len(insert_result.inserted_ids)
-        
-        print(f"Successfully inserted {inserted_count} strategies into database")
-        return inserted_count
+        operations = []
+        if deleted_files:
+            operations.append(DeleteMany({"filename": {"$in": deleted_files}}))
+        for strategy in strategies:
+            # Replaces a document of the file stored under another name (its class name before)
+            operations.append(DeleteMany({"filename": strategy['filename'], "name": {"$ne": strategy['name']}}))
+            operations.append(UpdateOne({"name": strategy['name']}, {"$set": strategy}, upsert=True))
+        if not operations:
+            return True
+        
+        result = db.strategies.bulk_write(operations)
+        print(f"Upserted {result.upserted_count + result.modified_count} and deleted {result.deleted_count} strategies")
+        return True
         
     except Exception as e:
-        print(f"Error inserting strategies to database: {e}")
-        return 0
+        print(f"Error updating strategies in database: {e}")
+        return False
 
 def create_strategy_groups(strategies: List[Dict]) -> None:
     """
@@ -324,109 +232,56 @@ def create_strategy_groups(strategies: List[Dict]) -> None:
     except Exception as e:
         print(f"Error creating strategy groups: {e}")
 
-def cleanup_temp_directory(temp_dir: str) -> None:
-    """
-    Clean up temporary directory with better Windows support
-    """
-    try:
-        if os.path.exists(temp_dir):
-            # On Windows, we need to handle file permissions and locks
-            if os.name == 'nt':  # Windows
-                import stat
-                
-                def handle_remove_readonly(func, path, exc):
-                    """Error handler for Windows readonly files"""
-                    if os.path.exists(path):
-                        os.chmod(path, stat.S_IWRITE)
-                        func(path)
-                
-                shutil.rmtree(temp_dir, onerror=handle_remove_readonly)
-            else:
-                shutil.rmtree(temp_dir)
-            
-            print(f"Cleaned up temporary directory: {temp_dir}")
-    except PermissionError as e:
-        print(f"Permission error cleaning up temp directory (this is normal on Windows): {e}")
-        print("You may need to manually delete the temp_strategies folder later")
-    except Exception as e:
-        print(f"Error cleaning up temp directory: {e}")
-        print("You may need to manually delete the temp_strategies folder")
-
-def main():
+def main(full: bool = False):
     """Main function"""
     print("=== Freqtrade Strategies Fetcher ===")
-    print("Fetching trading strategies from GitHub repository...")
+    print("Syncing trading strategies from GitHub repository...")
     
-    temp_dir = "temp_strategies"
+    mirror_dir = "strategies_mirror"
+    changes = sync_strategies_repo(mirror_dir, full)
+    if changes is None:
+        print("Failed to sync repository. Exiting.")
+        return
     
-    try:
-        # Clone repository
-        if not clone_strategies_repo(temp_dir):
-            print("Failed to clone repository. Exiting.")
-            return
-        
-        # Find strategy files
-        strategy_files = find_strategy_files(temp_dir)
-        
-        if not strategy_files:
-            print("No strategy files found. Exiting.")
-            return
-        
-        print(f"Processing {len(strategy_files)} strategy files...")
-        
-        # Process each strategy file
-        strategies = []
-        processed = 0
-        
-        for file_path in strategy_files:
-            print(f"Processing: {os.path.basename(file_path)}")
-            strategy_info = extract_strategy_info(file_path)
-            
-            if strategy_info:
-                strategies.append(strategy_info)
-                processed += 1
-            
-            # Show progress
-            if processed % 10 == 0:
-                print(f"Processed {processed}/{len(strategy_files)} files...")
-        
-        print(f"\nSuccessfully processed {len(strategies)} strategies")
+    if changes.empty:
+        print(f"Already up to date at {changes.head[:8]}")
+        return
+    
+    print(f"{'Full sync' if changes.full else f'Changes {changes.base[:8]}..{changes.head[:8]}'}: "
+          f"{len(changes.changed)} added or modified, {len(changes.deleted)} deleted")
+    
+    # Strategies of earlier syncs that are gone from the repository are deleted on a full sync
+    files, deleted_files = flat_changes(mirror_dir, "filtered", changes, get_db().strategies.distinct("filename"))
+    strategy_files = [os.path.join(mirror_dir, path) for path in files.values()]
+    
+    # Parse the changed strategy files on a process pool
+    strategies = []
+    for file_path, metadata in zip(strategy_files, scan_strategies(strategy_files)):
+        strategy_info = extract_strategy_info(file_path, metadata)
         
-        if strategies:
-            # Copy strategy files to server directory for backtesting
-            print(f"\nCopying strategy files to server directory...")
-            copied_count = copy_strategies_to_server(strategy_files)
-            
-            # Insert strategies to database
-            inserted_count = insert_strategies_to_database(strategies)
-            
-            if inserted_count > 0:
-                print(f"\n✅ Successfully inserted {inserted_count} strategies to database")
-                print(f"✅ Successfully copied {copied_count} strategy files to server/strategies")
-                
-                # Create strategy groups
-                print("\nCreating strategy groups...")
-                create_strategy_groups(strategies)
-                
-                print("\n🎉 Strategies update completed successfully!")
-                print(f"Total strategies in database: {inserted_count}")
-                print(f"Total strategy files copied: {copied_count}")
-                
-                # Show sample strategies
-                print("\nSample strategies:")
-                for i, strategy in enumerate(strategies[:5]):
-                    print(f"  {i+1}. {strategy['name']} - {strategy['description']}")
-                    if strategy['indicators']:
-                        print(f"     Indicators: {', '.join(strategy['indicators'][:5])}")
-                
-            else:
-                print("\n❌ Failed to insert strategies to database")
-        else:
-            print("\n❌ No valid strategies found to insert")
+        if strategy_info:
+            strategies.append(strategy_info)
+    
+    print(f"\nSuccessfully processed {len(strategies)} strategies")
+    
+    # Copy strategy files to server directory for backtesting
+    print("\nUpdating strategy files in server directory...")
+    copied_count = copy_strategies_to_server(strategy_files, deleted_files)
+    
+    if not apply_strategies_to_database(strategies, deleted_files):
+        print("\n❌ Failed to update strategies in database")
+        return
+    # Only once applied, a failed run is diffed from the same commit again
+    set_synced_commit(get_db(), SYNC_KEY, changes.head)
+    
+    print("\nCreating strategy groups...")
+    all_strategies = list(get_db().strategies.find({}, {"name": 1, "description": 1, "indicators": 1}))
+    create_strategy_groups(all_strategies)
     
-    finally:
-        # Cleanup
-        cleanup_temp_directory(temp_dir)
+    print("\n🎉 Strategies update completed successfully!")
+    print(f"Total strategies in database: {len(all_strategies)}")
+    print(f"Strategy files copied: {copied_count}, deleted: {len(deleted_files)}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    # --full re-applies every strategy file, e.g. after the server directory was wiped
+    main(full="--full" in sys.argv) 
\ No newline at end of file
@@ -1,27 +1,63 @@
+from typing import Literal
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 
-from db import get_db
+from db import get_async_db
+from routes.pagination import after_cursor
 from schemas import BacktestingRequest
-import services.services as serv
+import services.async_services as serv
 from services.celery_service import start_backtesting_batch
 
 
 router = APIRouter()
 
 @router.get("", response_model=list[dict])
-def get_backtestings(db=Depends(get_db)):
-    res = serv.get_backtestings(db)
+async def get_backtestings(
+    limit: int = Query(None, ge=1, le=1000),
+    after: str = Depends(after_cursor),
+    sort: Literal["id", "-id", "start_date", "-start_date"] = "id",
+    db=Depends(get_async_db),
+):
+    res = await serv.get_backtestings(db, limit, after, sort)
     return res
 
 @router.get("/{id}/performances")
-def get_backtesting_performance(id: str,db=Depends(get_db)):
-    res = serv.get_backtesting_performance(db, id)
+async def get_backtesting_performance(id: str,db=Depends(get_async_db)):
+    res = await serv.get_backtesting_performance(db, id)
+    return res
+
+@router.get("/{id}/trades")
+async def get_backtesting_trades(
+    id: str,
+    strategy: str = None,
+    pair: str = None,
+    start_date: str = None,
+    end_date: str = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db=Depends(get_async_db),
+):
+    res = await serv.get_backtesting_trades(db, id, strategy, pair, start_date, end_date, skip, limit)
+    return res
+
+@router.get("/{id}/trades/stats")
+async def get_backtesting_trade_stats(
+    id: str,
+    group_by: Literal["pair", "strategy_name", "exit_reason", "enter_tag"] = "pair",
+    strategy: str = None,
+    pair: str = None,
+    start_date: str = None,
+    end_date: str = None,
+    db=Depends(get_async_db),
+):
+    res = await serv.get_backtesting_trade_stats(db, id, group_by, strategy, pair, start_date, end_date)
     return res
 
 @router.post("")
-def create_backtesting(backtesting: BacktestingRequest, db=Depends(get_db)):
-    res = serv.create_backtesting(db, backtesting.model_dump())
+async def create_backtesting(backtesting: BacktestingRequest, db=Depends(get_async_db)):
+    res = await serv.create_backtesting(db, backtesting.model_dump())
     if res:
-        start_backtesting_batch.delay(str(res))
+        # Publishing to the broker is blocking
+        await run_in_threadpool(start_backtesting_batch.delay, str(res))
     return res
\ No newline at end of file
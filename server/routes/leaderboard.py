@@ -0,0 +1,21 @@
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Query
+
+from db import get_async_db
+import services.async_services as srv
+
+
+router = APIRouter()
+
+@router.get("")
+async def get_leaderboard(
+    sort: Literal["profit", "profit_percentage", "win_rate", "max_drawdown", "profit_factor", "trade_per_day"] = "profit",
+    timeframe: list[str] = Query(None),
+    pair_group_id: list[str] = Query(None),
+    backtesting_id: list[str] = Query(None),
+    limit: int = Query(50, ge=1, le=1000),
+    db=Depends(get_async_db),
+):
+    res = await srv.get_leaderboard(db, sort, timeframe, pair_group_id, backtesting_id, limit)
+    return res
@@ -0,0 +1,9 @@
+from bson.objectid import ObjectId
+from fastapi import HTTPException
+
+
+def after_cursor(after: str = None) -> str:
+    # Keyset pages start after the id of the previous page's last item
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail=f"Invalid after cursor: {after}")
+    return after
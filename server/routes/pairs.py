@@ -1,34 +1,39 @@
 
+from typing import Literal
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 
-from db import get_db
+from db import get_async_db
+from routes.pagination import after_cursor
 from schemas import PairGroupRequest
-import services.services as srv
+import services.async_services as srv
 
 
 router = APIRouter()
 
 @router.get("")
-def get_pair_groups(db=Depends(get_db)):
-    res = srv.get_pair_groups(db)
+async def get_pair_groups(db=Depends(get_async_db)):
+    res = await srv.get_pair_groups(db)
     return res
 
 
 @router.post("")
-def create_pair_group(pair_group: PairGroupRequest, db=Depends(get_db)):
-    res = srv.create_pair_group(db, pair_group)
+async def create_pair_group(pair_group: PairGroupRequest, db=Depends(get_async_db)):
+    res = await srv.create_pair_group(db, pair_group)
     return res
 
 
 @router.delete("/{pair_group_id}")
-def get_pair_group(pair_group_id: str, db=Depends(get_db)):
-    res = srv.delete_pair_group(db, pair_group_id)
+async def get_pair_group(pair_group_id: str, db=Depends(get_async_db)):
+    res = await srv.delete_pair_group(db, pair_group_id)
     return res
 
 @router.get("/pairs")
-def get_pairs(db=Depends(get_db)):
-    print(f"Getting pairs from db: {type(db)}")
-    res = srv.get_pairs(db)
-    print(f"Found {len(res)} pairs")
+async def get_pairs(
+    limit: int = Query(None, ge=1, le=1000),
+    after: str = Depends(after_cursor),
+    sort: Literal["id", "-id", "name", "-name"] = "id",
+    db=Depends(get_async_db),
+):
+    res = await srv.get_pairs(db, limit, after, sort)
     return res
\ No newline at end of file
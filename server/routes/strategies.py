@@ -1,27 +1,40 @@
+from typing import Literal
 
-from fastapi import APIRouter, Depends
-from db import get_db, get_ai
-import services.services as srv
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from db import get_async_db, get_ai
+from routes.pagination import after_cursor
+import services.async_services as srv
 from schemas import AIQueryRequest, StrategyUpdateRequest
 
 router = APIRouter()
 
 @router.get("")
-def get_strategies(db=Depends(get_db)):
-    res = srv.get_strategies(db)
+async def get_strategies(
+    limit: int = Query(None, ge=1, le=1000),
+    after: str = Depends(after_cursor),
+    sort: Literal["id", "-id", "name", "-name"] = "id",
+    db=Depends(get_async_db),
+):
+    res = await srv.get_strategies(db, limit, after, sort)
     return res
 
 @router.get("/{strategyId}")
-def get_strategy(strategyId: str, db=Depends(get_db)):
-    res = srv.get_strategy(db, strategyId)
+async def get_strategy(strategyId: str, db=Depends(get_async_db)):
+    res = await srv.get_strategy(db, strategyId)
     return res
 
 @router.put("/{strategyId}")
-def save_strategy(strategyId: str, strategy: StrategyUpdateRequest, db=Depends(get_db)):
-    res = srv.save_strategy(db, strategyId, strategy.model_dump())
+async def save_strategy(strategyId: str, strategy: StrategyUpdateRequest, db=Depends(get_async_db)):
+    res = await srv.save_strategy(db, strategyId, strategy.model_dump())
     return res
 
+# Repeated queries are answered from the response cache, stream=true sends the
+# answer as plain text while the model writes it
 @router.post("/{strategyId}/ai-query")
-def ai_query(strategyId: str, query_request: AIQueryRequest, db=Depends(get_db), llm=Depends(get_ai)):
-    res = srv.query_ai(db, llm, strategyId, query_request.query, query_request.query_type, query_request.content)
-    return res
\ No newline at end of file
+async def ai_query(strategyId: str, query_request: AIQueryRequest, stream: bool = False, db=Depends(get_async_db), llm=Depends(get_ai)):
+    if stream:
+        chunks = await srv.stream_ai(db, llm, strategyId, query_request.query, query_request.query_type, query_request.content)
+        return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
+    res = await srv.query_ai(db, llm, strategyId, query_request.query, query_request.query_type, query_request.content)
+    return res
@@ -1,26 +1,26 @@
 from fastapi import APIRouter, Depends
-from db import get_db
-import services.services as srv
+from db import get_async_db
+import services.async_services as srv
 
 router = APIRouter()
 
 
 @router.get("")
-def get_strategy_groups(db = Depends(get_db)):
-    return srv.get_strategy_groups(db)
+async def get_strategy_groups(db = Depends(get_async_db)):
+    return await srv.get_strategy_groups(db)
 
 @router.get("/{id}")
-def get_strategy_group(db = Depends(get_db), *, id: str):
-    return srv.get_strategy_group(db, id)
+async def get_strategy_group(db = Depends(get_async_db), *, id: str):
+    return await srv.get_strategy_group(db, id)
 
 @router.post("")
-def create_strategy_group(streategy_group: dict, db = Depends(get_db)):
-    return srv.create_strategy_group(db, streategy_group)
+async def create_strategy_group(streategy_group: dict, db = Depends(get_async_db)):
+    return await srv.create_strategy_group(db, streategy_group)
 
 @router.put("/{id}")
-def update_strategy_group(id: str, streategy_group: dict, db = Depends(get_db)):
-    return srv.update_strategy_group(db, id, streategy_group)
+async def update_strategy_group(id: str, streategy_group: dict, db = Depends(get_async_db)):
+    return await srv.update_strategy_group(db, id, streategy_group)
 
 @router.delete("/{id}")
-def delete_strategy_group(id: str, db = Depends(get_db)):
-    return srv.delete_strategy_group(db, id)
\ No newline at end of file
+async def delete_strategy_group(id: str, db = Depends(get_async_db)):
+    return await srv.delete_strategy_group(db, id)
\ No newline at end of file
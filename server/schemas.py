@@ -32,6 +32,8 @@ class BacktestingRequest(BaseModel):
     timeframe: str
     pair_group_id: str
     strategy_id: str
+    # More strategies backtested in the same batch, sharded over the backtest workers
+    strategy_ids: list[str] = []
 
 
 class BacktestingResponse(BaseModel):
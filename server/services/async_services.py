@@ -0,0 +1,162 @@
+from typing import AsyncIterator
+
+from bson.objectid import ObjectId
+from langchain_core.language_models import BaseChatModel
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+
+from services.leaderboard import (
+    ROLLUP_COLLECTION, leaderboard_row, performance_group_stage, ranking_stages, rollup_group_stage, rollup_match,
+)
+from services.llm_pipeline import model_name
+from services.response_cache import ai_query_cache
+from services.services import (
+    BACKTESTING_SUMMARY_FIELDS, PAIR_FIELDS, STRATEGY_FIELDS, STRATEGY_SUMMARY_FIELDS,
+    _ai_query_key, _ai_query_messages, _backtesting_summary, _keyset_query, _new_backtesting, _pair, _pair_group, _performance,
+    _sort_field, _strategy, _strategy_group, _strategy_group_document, _strategy_summary,
+    _strategy_update, _trade, _trade_filter, _trade_stats, _trade_stats_pipeline,
+)
+
+# Services of the API routes, awaited on the event loop instead of a threadpool
+# worker. services.services keeps the blocking ones Celery tasks and scripts use,
+# and the query / response builders shared with them.
+
+
+async def _keyset_page(collection: AsyncCollection, query: dict, projection: dict, sort: str = "id", after: str = None, limit: int = None):
+    anchor = None
+    if after:
+        anchor = await collection.find_one({"_id": ObjectId(after)}, {_sort_field(sort): 1}) or {"_id": ObjectId(after)}
+    query, order = _keyset_query(query, sort, anchor)
+    res = collection.find(query, projection).sort(order)
+    if limit:
+        res = res.limit(limit)
+    return await res.to_list()
+
+async def get_backtestings(db: AsyncDatabase, limit: int = None, after: str = None, sort: str = "id"):
+    res = await _keyset_page(db.get_collection("backtestings"), {}, BACKTESTING_SUMMARY_FIELDS, sort, after, limit)
+    return [_backtesting_summary(r) for r in res]
+
+async def create_backtesting(db: AsyncDatabase, backtesting: dict):
+    res = await db.get_collection("backtestings").insert_one(_new_backtesting(backtesting))
+    return str(res.inserted_id)
+
+async def get_backtesting_performance(db: AsyncDatabase, id: str):
+    res = await db.get_collection("backtestings").find_one({"_id": ObjectId(id)}, {"performances": 1})
+    res = db.get_collection("strategy_performances").find({"_id": {"$in": res["performances"]}})
+    return [_performance(r) async for r in res]
+
+async def get_backtesting_trades(db: AsyncDatabase, id: str, strategy_name: str = None, pair: str = None, start_date: str = None, end_date: str = None, skip: int = 0, limit: int = 100):
+    res = db.get_collection("backtest_trades").find(
+        _trade_filter(id, strategy_name, pair, start_date, end_date),
+        {"_id": 0, "backtesting_id": 0},
+    ).sort("open_date", 1).skip(skip).limit(limit)
+    return [_trade(r) async for r in res]
+
+async def get_backtesting_trade_stats(db: AsyncDatabase, id: str, group_by: str = "pair", strategy_name: str = None, pair: str = None, start_date: str = None, end_date: str = None):
+    res = await db.get_collection("backtest_trades").aggregate(
+        _trade_stats_pipeline(_trade_filter(id, strategy_name, pair, start_date, end_date), group_by)
+    )
+    return [_trade_stats(r, group_by) async for r in res]
+
+async def get_pairs(db: AsyncDatabase, limit: int = None, after: str = None, sort: str = "id"):
+    res = await _keyset_page(db.get_collection("pairs"), {}, PAIR_FIELDS, sort, after, limit)
+    return [_pair(r) for r in res]
+
+async def get_pair_groups(db: AsyncDatabase):
+    return [_pair_group(r) async for r in db.get_collection("pair_groups").find()]
+
+async def create_pair_group(db: AsyncDatabase, pair_group):
+    document = {
+        "name": pair_group.name,
+        "pairs": pair_group.pairs,
+        "description": pair_group.description,
+    }
+    res = await db.get_collection("pair_groups").insert_one(document)
+    return _pair_group({**document, "_id": res.inserted_id})
+
+async def delete_pair_group(db: AsyncDatabase, id: str):
+    res = await db.get_collection("pair_groups").delete_one({"_id": ObjectId(id)})
+    return str(res.deleted_count)
+
+async def get_strategy_groups(db: AsyncDatabase):
+    return [_strategy_group(r) async for r in db.get_collection("strategy_groups").find()]
+
+async def get_strategy_group(db: AsyncDatabase, id: str):
+    res = await db.get_collection("strategy_groups").find_one({"_id": ObjectId(id)})
+    return _strategy_group(res)
+
+async def create_strategy_group(db: AsyncDatabase, strategy_group: dict):
+    document = _strategy_group_document(strategy_group)
+    res = await db.get_collection("strategy_groups").insert_one(document)
+    return _strategy_group({**document, "_id": res.inserted_id})
+
+async def update_strategy_group(db: AsyncDatabase, id: str, strategy_group: dict):
+    res = await db.get_collection("strategy_groups").update_one({
+        '_id': ObjectId(id)
+    }, {
+        '$set': _strategy_group_document(strategy_group)
+    }, upsert=True)
+    return str(res.upserted_id)
+
+async def delete_strategy_group(db: AsyncDatabase, id: str):
+    res = await db.get_collection("strategy_groups").delete_one({"_id": ObjectId(id)})
+    return str(res.deleted_count)
+
+async def get_strategies(db: AsyncDatabase, limit: int = None, after: str = None, sort: str = "id"):
+    res = await _keyset_page(db.get_collection("strategies"), {}, STRATEGY_SUMMARY_FIELDS, sort, after, limit)
+    return [_strategy_summary(r) for r in res]
+
+async def get_strategy(db: AsyncDatabase, id: str):
+    res = await db.get_collection("strategies").find_one({"_id": ObjectId(id)}, STRATEGY_FIELDS)
+    return _strategy(res)
+
+async def save_strategy(db: AsyncDatabase, id: str, strategy: dict):
+    res = await db.get_collection("strategies").update_one({
+        '_id': ObjectId(id)
+    }, {
+        '$set': _strategy_update(strategy)
+    }, upsert=True)
+    return str(res.upserted_id)
+
+async def _ai_query(db: AsyncDatabase, llm: BaseChatModel, strategy_id: str, query: str, query_type: str, content: str = None):
+    res = await db.get_collection("strategies").find_one({"_id": ObjectId(strategy_id)}, {"code": 1, query_type: 1})
+    data = content or res.get(query_type, "")
+    code = res.get("code", "")
+    key = _ai_query_key(strategy_id, code, query_type, query, data, model_name(llm))
+    return key, _ai_query_messages(code, query_type, data, query)
+
+async def query_ai(db: AsyncDatabase, llm: BaseChatModel, strategy_id: str, query: str, query_type: str, content: str = None):
+    key, messages = await _ai_query(db, llm, strategy_id, query, query_type, content)
+
+    async def create():
+        res = await llm.ainvoke(messages)
+        return res.content
+    return await ai_query_cache.get_or_create(key, create)
+
+async def stream_ai(db: AsyncDatabase, llm: BaseChatModel, strategy_id: str, query: str, query_type: str, content: str = None) -> AsyncIterator[str]:
+    key, messages = await _ai_query(db, llm, strategy_id, query, query_type, content)
+
+    async def chunks():
+        async for chunk in llm.astream(messages):
+            yield chunk.content
+    return ai_query_cache.stream(key, chunks)
+
+async def get_leaderboard(db: AsyncDatabase, sort: str = "profit", timeframes: list[str] = None, pair_group_ids: list[str] = None, backtesting_ids: list[str] = None, limit: int = 50):
+    if backtesting_ids:
+        # A hand-picked set of backtests is ranked from its own performance rows
+        backtestings = db.get_collection("backtestings").find(
+            {"_id": {"$in": [ObjectId(backtesting_id) for backtesting_id in backtesting_ids]}}, {"performances": 1}
+        )
+        performance_ids = [performance_id async for backtesting in backtestings for performance_id in backtesting.get("performances", [])]
+        res = await db.get_collection("strategy_performances").aggregate([
+            {"$match": {"_id": {"$in": performance_ids}}},
+            performance_group_stage(),
+            *ranking_stages(sort, limit),
+        ])
+    else:
+        res = await db.get_collection(ROLLUP_COLLECTION).aggregate([
+            {"$match": rollup_match(timeframes, pair_group_ids)},
+            rollup_group_stage(),
+            *ranking_stages(sort, limit),
+        ])
+    return [leaderboard_row(r, rank) for rank, r in enumerate(await res.to_list(), start=1)]
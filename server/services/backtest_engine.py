@@ -0,0 +1,134 @@
+import os
+from collections import OrderedDict
+from copy import deepcopy
+
+from services.indicator_cache import INDICATOR_CACHE_SIZE_MB, IndicatorCache
+
+# "subprocess" runs every backtest as a new `freqtrade backtesting` process,
+# "inprocess" runs them through freqtrade's Python API inside the worker
+BACKTEST_ENGINE = os.environ.get("BACKTEST_ENGINE", "subprocess")
+
+
+class InProcessBacktestEngine:
+    """
+    Runs backtests through freqtrade's Python API in a long-lived worker.
+    freqtrade is imported once, exchanges keep their loaded markets and the
+    candle DataFrames of recent jobs stay in memory, so successive jobs only
+    pay for the simulation itself. Populated indicators are cached on disk
+    across jobs unless INDICATOR_CACHE_SIZE_MB is 0.
+    """
+
+    def __init__(self, max_datasets: int = int(os.environ.get("BACKTEST_ENGINE_DATASETS", 8))):
+        self.max_datasets = max_datasets
+        self.exchanges = {}
+        self.datasets = OrderedDict()
+        self.indicator_cache = IndicatorCache() if INDICATOR_CACHE_SIZE_MB > 0 else None
+
+    def get_exchange(self, config: dict):
+        from freqtrade.resolvers import ExchangeResolver
+        key = (config["exchange"]["name"], config.get("trading_mode"), config.get("margin_mode"))
+        if key not in self.exchanges:
+            self.exchanges[key] = ExchangeResolver.load_exchange(config, load_leverage_tiers=True)
+        return self.exchanges[key]
+
+    @staticmethod
+    def store_versions(backtesting) -> tuple:
+        """
+        Modification time of every whitelisted pair's candle file, so candles
+        rewritten by a later download are not served from memory.
+        """
+        from services.candle_store import CandleStore
+        datadir = str(backtesting.config["datadir"]).rstrip(os.sep)
+        store = CandleStore(
+            root=os.path.dirname(datadir),
+            exchange=os.path.basename(datadir),
+            trading_mode=backtesting.config.get("trading_mode", "spot"),
+            data_format=backtesting.config.get("dataformat_ohlcv", "feather"),
+        )
+        versions = []
+        for pair in backtesting.pairlists.whitelist:
+            path = store.candle_path(pair, backtesting.timeframe)
+            versions.append(os.path.getmtime(path) if os.path.exists(path) else None)
+        return tuple(versions)
+
+    def load_data(self, backtesting):
+        """
+        Replacement for Backtesting.load_bt_data serving candles from memory.
+        Whatever load_bt_data sets on the instance (timerange, available_pairs,
+        price_pair_prec, ...) is recorded on a miss and restored on a hit.
+        """
+        from freqtrade.optimize.backtesting import Backtesting
+        key = (
+            str(backtesting.config["datadir"]),
+            tuple(backtesting.pairlists.whitelist),
+            backtesting.timeframe,
+            str(backtesting.config.get("timerange")),
+            backtesting.required_startup,
+            self.store_versions(backtesting),
+        )
+        if key in self.datasets:
+            self.datasets.move_to_end(key)
+            data, attributes = self.datasets[key]
+            for name, value in attributes.items():
+                setattr(backtesting, name, deepcopy(value) if name in ("timerange", "available_pairs") else value)
+            backtesting._load_bt_data_detail()
+            return data, backtesting.timerange
+        before = dict(vars(backtesting))
+        data, timerange = Backtesting.load_bt_data(backtesting)
+        attributes = {
+            name: value for name, value in vars(backtesting).items()
+            if (name not in before or before[name] is not value) and not name.startswith("detail")
+        }
+        attributes["timerange"] = deepcopy(timerange)
+        if not hasattr(backtesting, "available_pairs"):
+            backtesting.available_pairs = list(data.keys())
+        attributes["available_pairs"] = list(backtesting.available_pairs)
+        self.datasets[key] = (data, attributes)
+        while len(self.datasets) > self.max_datasets:
+            self.datasets.popitem(last=False)
+        return data, timerange
+
+    def run(self, config_filepath: str, userdir: str, datadir: str, strategies: list[str], pairs: list[str], timerange: str, timeframe: str, result_file: str, log_file: str) -> dict:
+        """
+        Same as `freqtrade backtesting --strategy-list ... --export trades`,
+        results are stored to `result_file` the way the CLI does it.
+        """
+        from freqtrade.commands.optimize_commands import setup_optimize_configuration
+        from freqtrade.enums import RunMode
+        from freqtrade.optimize.backtesting import Backtesting
+        config = setup_optimize_configuration({
+            "config": [config_filepath],
+            "user_data_dir": userdir,
+            "datadir": datadir,
+            "strategy_list": strategies,
+            "pairs": pairs,
+            "timerange": timerange,
+            "timeframe": timeframe,
+            "export": "trades",
+            "exportfilename": result_file,
+            "backtest_cache": "none",
+            "logfile": log_file,
+        }, RunMode.BACKTEST)
+        backtesting = Backtesting(config, exchange=self.get_exchange(config))
+        backtesting.load_bt_data = lambda: self.load_data(backtesting)
+        if self.indicator_cache:
+            for strategy in backtesting.strategylist:
+                self.indicator_cache.attach(strategy)
+        try:
+            backtesting.start()
+        finally:
+            Backtesting.cleanup()
+        if self.indicator_cache:
+            print(f"Indicator cache: {self.indicator_cache.stats()}")
+        return backtesting.results
+
+
+_engine = None
+
+
+def get_engine() -> InProcessBacktestEngine:
+    # One engine per worker process, kept for the lifetime of the process
+    global _engine
+    if _engine is None:
+        _engine = InProcessBacktestEngine()
+    return _engine
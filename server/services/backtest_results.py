@@ -0,0 +1,159 @@
+import glob
+import io
+import json
+import os
+import re
+from typing import Callable, Iterator
+from zipfile import ZipFile
+
+_DELIMITER = re.compile(r"[,\]}\s]")
+
+
+def find_result_files(prefix: str) -> list[str]:
+    """
+    Result files written by `freqtrade backtesting --backtest-filename {prefix}.json`.
+    freqtrade appends a timestamp to the name and, since 2025, zips the stats.
+    """
+    files = glob.glob(f"{prefix}*.json") + glob.glob(f"{prefix}*.zip")
+    return [f for f in files if not f.endswith(".meta.json") and not f.endswith("_config.json")]
+
+
+class JsonStream:
+    """
+    Minimal pull parser over a JSON text stream. Objects and arrays can be
+    walked member by member, any other value is decoded whole, so only the
+    value being read is ever held in memory.
+    """
+
+    def __init__(self, f, chunk_size: int = 1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"Expected {ch!r} at offset {self.pos}, got {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        if self.peek() in "-0123456789":
+            # A number may continue in the next chunk, read up to its delimiter first
+            while not _DELIMITER.search(self.buf, self.pos) and self._fill():
+                pass
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def _separator(self, close: str) -> bool:
+        ch = self.peek()
+        self.pos += 1
+        if ch == close:
+            return False
+        if ch != ",":
+            raise ValueError(f"Expected ',' or {close!r} at offset {self.pos - 1}, got {ch!r}")
+        return True
+
+    def keys(self) -> Iterator[str]:
+        """
+        Keys of the object at the cursor. The caller must consume each
+        member's value (`value`, `keys`, `items` or `skip`) before the next key.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if not self._separator("}"):
+                return
+
+    def items(self) -> Iterator:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if not self._separator("]"):
+                return
+
+    def skip(self):
+        if self.peek() == "[":
+            for _ in self.items():
+                pass
+        else:
+            self.value()
+
+
+def _open_result(result_file: str):
+    if result_file.endswith(".zip"):
+        zipf = ZipFile(result_file)
+        stats_name = os.path.basename(result_file)[:-len(".zip")] + ".json"
+        return zipf, io.TextIOWrapper(zipf.open(stats_name), encoding="utf-8")
+    return None, open(result_file, "r", encoding="utf-8")
+
+
+def iter_strategy_results(result_file: str, trade_sink: Callable[[str, dict], None] = None) -> Iterator[dict]:
+    """
+    Stream the per-strategy summaries out of a result file without loading it.
+    `trades` are left out of the details; if `trade_sink` is given it is called
+    with (strategy, trade) for every trade instead.
+    """
+    zipf, f = _open_result(result_file)
+    try:
+        stream = JsonStream(f)
+        if stream.peek() != "{":
+            return
+        for key in stream.keys():
+            if key != "strategy":
+                stream.skip()
+                continue
+            for strategy in stream.keys():
+                details = {}
+                for field in stream.keys():
+                    if field != "trades":
+                        details[field] = stream.value()
+                    elif trade_sink is None:
+                        stream.skip()
+                    else:
+                        for trade in stream.items():
+                            trade_sink(strategy, trade)
+                yield {
+                    "key": strategy,
+                    "details": details,
+                }
+    finally:
+        f.close()
+        if zipf:
+            zipf.close()
+
+
+def read_strategy_results(result_file: str, trade_sink: Callable[[str, dict], None] = None) -> list[dict]:
+    return list(iter_strategy_results(result_file, trade_sink))
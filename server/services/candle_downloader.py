@@ -0,0 +1,140 @@
+import re
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from textwrap import dedent
+
+from services.candle_store import CandleStore, as_utc, can_resample, candle_open, timeframe_to_timedelta
+
+
+@dataclass
+class DownloadReport:
+    reused: int = 0
+    fetched: int = 0
+    resampled: int = 0
+    ranges: list[str] = field(default_factory=list)
+    # Ranges whose download-data command exited with an error
+    failed: list[str] = field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f"Reused {self.reused} candles, fetched {self.fetched} candles in {len(self.ranges)} missing ranges, "
+            f"resampled {self.resampled} candles, {len(self.failed)} failed downloads"
+        )
+
+
+class IncrementalDownloader:
+    """
+    Downloads only the time ranges a CandleStore does not cover yet.
+    Each missing range is fetched into a scratch datadir and merged into the
+    store, so holes in the middle of the stored data can be filled too.
+    Higher timeframes made of whole candles of the finest one (1h, 1d, ...
+    from 5m) are resampled locally where the finest one covers them.
+    """
+
+    def __init__(self, store: CandleStore, config_filepath: str, log_filepath: str, userdir: str = None):
+        self.store = store
+        self.config_filepath = config_filepath
+        self.log_filepath = log_filepath
+        self.userdir = userdir
+
+    def build_download_command(self, pairs: list[str], timeframe: str, start_date: datetime, end_date: datetime, datadir: str):
+        timerange = f"{int(start_date.timestamp())}-{int(end_date.timestamp())}"
+        command = dedent(f"""
+            freqtrade download-data --exchange {self.store.exchange} --timerange {timerange}
+            --timeframe {timeframe} -p {" ".join(pairs)} --config {self.config_filepath}
+            --include-inactive-pairs --trading-mode {self.store.trading_mode} --log-file {self.log_filepath} --datadir {datadir}
+            {f'--userdir {self.userdir}' if self.userdir else ''}
+        """).strip().replace("\n", " ")
+        command = re.sub(r"\s+", " ", command)
+        return command
+
+    def mark_confirmed_empty(self, pair: str, timeframe: str, range_start: datetime, range_end: datetime, fetched: int):
+        """
+        Remember the holes left in a fetched range the exchange has no candles
+        for: holes between stored candles (maintenance) and, when the exchange
+        answered for this pair, the hole before its first candle (listing). A
+        pair that got nothing at the edges, e.g. silently failing in a
+        multi-pair command, is asked again next time.
+        """
+        dates = self.store.load_dates(pair, timeframe)
+        if dates.empty:
+            return
+        first, last = dates.min().to_pydatetime(), dates.max().to_pydatetime()
+        for hole_start, hole_end in self.store.missing_ranges(pair, timeframe, range_start, range_end):
+            # The tail after the last candle may still be filled by the exchange
+            if hole_end > last:
+                continue
+            if hole_start > first or fetched:
+                self.store.mark_empty(pair, timeframe, hole_start, hole_end)
+
+    def download(self, pairlist: list[str], timeframes: list[str], start_date: datetime, end_date: datetime) -> DownloadReport:
+        return self.download_windows({(pair, timeframe): (start_date, end_date) for pair in pairlist for timeframe in timeframes})
+
+    def download_windows(self, windows: dict[tuple[str, str], tuple[datetime, datetime]]) -> DownloadReport:
+        """
+        Make the store cover the (start, end) window of every (pair, timeframe).
+        """
+        report = DownloadReport()
+        windows = {key: (as_utc(start), as_utc(end)) for key, (start, end) in windows.items()}
+        # Per pair the finest timeframe is fetched and the higher ones are
+        # resampled from it inside its window only. The base window is never
+        # widened for them: the part of a higher timeframe reaching further back
+        # (its startup candles, e.g. 200 daily ones) is fetched directly.
+        fetch, resample = {}, {}
+        for pair in dict.fromkeys(pair for pair, _ in windows):
+            timeframes = [timeframe for window_pair, timeframe in windows if window_pair == pair]
+            base_timeframe = min(timeframes, key=timeframe_to_timedelta)
+            base_start, base_end = windows[(pair, base_timeframe)]
+            for timeframe in timeframes:
+                start_date, end_date = windows[(pair, timeframe)]
+                if timeframe == base_timeframe or not can_resample(base_timeframe, timeframe) or timeframe[-1] in "wM" or end_date > base_end:
+                    fetch[(pair, timeframe)] = (start_date, end_date)
+                    continue
+                # First candle the base window covers completely
+                split = candle_open(base_start, timeframe)
+                if split < base_start:
+                    split += timeframe_to_timedelta(timeframe)
+                split = max(split, candle_open(start_date, timeframe))
+                if start_date < split:
+                    fetch[(pair, timeframe)] = (start_date, split)
+                if split < end_date:
+                    resample[(pair, timeframe)] = (base_timeframe, split)
+
+        with self.store.lock([*fetch, *resample]):
+            # Pairs sharing the same hole (typically the tail of a rolling window)
+            # are fetched with a single command
+            missing = {}
+            for (pair, timeframe), (start_date, end_date) in fetch.items():
+                ranges = self.store.missing_ranges(pair, timeframe, start_date, end_date)
+                dates = self.store.load_dates(pair, timeframe)
+                report.reused += int(((dates >= start_date) & (dates < end_date)).sum())
+                for range_start, range_end in ranges:
+                    missing.setdefault((timeframe, range_start, range_end), []).append(pair)
+
+            for (timeframe, range_start, range_end), pairs in missing.items():
+                scratch_dir = tempfile.mkdtemp(dir=self.store.root)
+                try:
+                    command = self.build_download_command(pairs, timeframe, range_start, range_end, scratch_dir)
+                    print(f"Running command: {command}")
+                    res = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=1800)
+                    if res.returncode != 0:
+                        print(res.stderr)
+                        error = (res.stderr.strip().splitlines() or [f"exit code {res.returncode}"])[-1]
+                        report.failed.extend(f"{pair} {timeframe} {range_start.isoformat()} - {range_end.isoformat()}: {error}" for pair in pairs)
+                        continue
+                    added = self.store.merge_from(scratch_dir)
+                finally:
+                    shutil.rmtree(scratch_dir, ignore_errors=True)
+                for pair in pairs:
+                    fetched = added.get(self.store.candle_path(pair, timeframe), 0)
+                    report.fetched += fetched
+                    report.ranges.append(f"{pair} {timeframe} {range_start.isoformat()} - {range_end.isoformat()}: {fetched}")
+                    self.mark_confirmed_empty(pair, timeframe, range_start, range_end, fetched)
+
+            for (pair, timeframe), (base_timeframe, start_date) in resample.items():
+                report.resampled += self.store.resample(pair, base_timeframe, timeframe, start_date)
+        print(report)
+        return report
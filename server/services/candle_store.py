@@ -0,0 +1,253 @@
+import json
+import os
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta, timezone
+
+CANDLE_STORE_DIR = os.environ.get("CANDLE_STORE_DIR", "./ftrade/data")
+# Seconds a range the exchange answered as empty is skipped before being asked again
+EMPTY_RANGE_TTL = float(os.environ.get("EMPTY_RANGE_TTL", 7 * 86400))
+
+
+def as_utc(dt: datetime) -> datetime:
+    # Backtesting dates are stored without timezone, candles are always UTC
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def timeframe_to_timedelta(timeframe: str) -> timedelta:
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 604800, "M": 2592000}
+    return timedelta(seconds=int(timeframe[:-1]) * units[timeframe[-1]])
+
+
+def align(dt: datetime, step: timedelta) -> datetime:
+    # Floor to the candle open time, e.g. 12:34 -> 12:30 on 5m
+    return dt - (dt - datetime(1970, 1, 1, tzinfo=timezone.utc)) % step
+
+
+def candle_open(dt: datetime, timeframe: str) -> datetime:
+    # Open time of the `timeframe` candle containing dt, exchanges start weeks on monday
+    if timeframe[-1] == "M":
+        return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if timeframe[-1] == "w":
+        # 1970-01-01 was a thursday
+        monday = timedelta(days=4)
+        return align(dt - monday, timeframe_to_timedelta(timeframe)) + monday
+    return align(dt, timeframe_to_timedelta(timeframe))
+
+
+def can_resample(base_timeframe: str, timeframe: str) -> bool:
+    # Every `timeframe` candle is made of whole `base_timeframe` candles
+    base_step, step = timeframe_to_timedelta(base_timeframe), timeframe_to_timedelta(timeframe)
+    if step <= base_step:
+        return False
+    if timeframe[-1] in "wM":
+        return timeframe == f"1{timeframe[-1]}" and timedelta(days=1) % base_step == timedelta(0)
+    return step % base_step == timedelta(0)
+
+
+def _resample_rule(timeframe: str) -> dict:
+    if timeframe[-1] == "M":
+        return {"rule": "MS"}
+    if timeframe[-1] == "w":
+        return {"rule": "W-MON", "closed": "left", "label": "left"}
+    return {"rule": f"{int(timeframe_to_timedelta(timeframe).total_seconds())}s", "origin": "epoch"}
+
+
+def pair_to_filename(pair: str) -> str:
+    # Same substitutions as freqtrade.misc.pair_to_filename
+    for ch in ["/", " ", ".", "@", "$", "+", ":"]:
+        pair = pair.replace(ch, "_")
+    return pair
+
+
+def _write_feather(candles, dest: str):
+    # Backtests read the store while downloads write it: write aside, then swap the file in
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=f".{os.path.basename(dest)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        candles.to_feather(tmp, compression_level=9, compression="lz4")
+        os.replace(tmp, dest)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+@contextmanager
+def _flock(path: str, timeout: int = 3600):
+    """
+    Exclusive lock on `path`. The kernel releases it when the holder closes the
+    file or dies, so a lock is never stale and never taken over.
+    """
+    import fcntl
+    fd = os.open(path, os.O_CREAT | os.O_RDWR)
+    try:
+        started = time.time()
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.time() - started > timeout:
+                    raise TimeoutError(f"Timed out waiting for candle store lock {path}")
+                time.sleep(1)
+        yield
+    finally:
+        # Closing releases the lock, the file is left for the next holder
+        os.close(fd)
+
+
+class CandleStore:
+    """
+    Shared OHLCV store, one file per (exchange, trading mode, pair, timeframe).
+    Files use freqtrade's own layout, so `datadir` can be handed to
+    `freqtrade download-data` / `freqtrade backtesting` as --datadir and every
+    job reads the same candles instead of keeping its own copy.
+    """
+
+    def __init__(self, root: str = CANDLE_STORE_DIR, exchange: str = "binance", trading_mode: str = "futures", data_format: str = "feather"):
+        self.root = root
+        self.exchange = exchange
+        self.trading_mode = trading_mode
+        self.data_format = data_format
+        self.datadir = os.path.join(root, exchange)
+        os.makedirs(self.datadir, exist_ok=True)
+
+    def candle_path(self, pair: str, timeframe: str) -> str:
+        if self.trading_mode == "futures":
+            return os.path.join(self.datadir, "futures", f"{pair_to_filename(pair)}-{timeframe}-futures.{self.data_format}")
+        return os.path.join(self.datadir, f"{pair_to_filename(pair)}-{timeframe}.{self.data_format}")
+
+    def load_dates(self, pair: str, timeframe: str):
+        import pandas as pd
+        path = self.candle_path(pair, timeframe)
+        if not os.path.exists(path):
+            return pd.Series([], dtype="datetime64[ns, UTC]")
+        return pd.read_feather(path, columns=["date"])["date"]
+
+    def missing_ranges(self, pair: str, timeframe: str, start_date: datetime, end_date: datetime) -> list[tuple[datetime, datetime]]:
+        """
+        Time ranges inside [start_date, end_date) without candles in the store:
+        before the first stored candle, holes between stored candles and after
+        the last one. Ranges the exchange already answered as empty are skipped.
+        """
+        step = timeframe_to_timedelta(timeframe)
+        start_date, end_date = align(as_utc(start_date), step), align(as_utc(end_date), step)
+        dates = self.load_dates(pair, timeframe)
+        dates = dates[(dates >= start_date) & (dates < end_date)].reset_index(drop=True)
+        if dates.empty:
+            ranges = [(start_date, end_date)]
+        else:
+            ranges = []
+            if dates.iloc[0] > start_date:
+                ranges.append((start_date, dates.iloc[0].to_pydatetime()))
+            for i in dates.index[dates.diff() > step]:
+                ranges.append(((dates.iloc[i - 1] + step).to_pydatetime(), dates.iloc[i].to_pydatetime()))
+            if dates.iloc[-1] + step < end_date:
+                ranges.append(((dates.iloc[-1] + step).to_pydatetime(), end_date))
+        known_empty = self._load_empty_ranges().get(os.path.basename(self.candle_path(pair, timeframe)), [])
+        return [
+            (s, e) for s, e in ranges
+            if not any(datetime.fromisoformat(es) <= s and e <= datetime.fromisoformat(ee) for es, ee, _ in known_empty)
+        ]
+
+    def mark_empty(self, pair: str, timeframe: str, start_date: datetime, end_date: datetime):
+        # The exchange has no candles here (before listing, maintenance), don't ask again for EMPTY_RANGE_TTL
+        path = os.path.join(self.datadir, ".empty_ranges.json")
+        # Shared by the workers downloading other pairs
+        with _flock(f"{path}.lock"):
+            empty_ranges = self._load_empty_ranges()
+            empty_ranges.setdefault(os.path.basename(self.candle_path(pair, timeframe)), []).append([start_date.isoformat(), end_date.isoformat(), time.time()])
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(empty_ranges, f)
+            os.replace(f"{path}.tmp", path)
+
+    def _load_empty_ranges(self) -> dict:
+        path = os.path.join(self.datadir, ".empty_ranges.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            empty_ranges = json.load(f)
+        # Expired marks, and the ones written without a date, are dropped
+        expires = time.time() - EMPTY_RANGE_TTL
+        return {
+            file: [mark for mark in marks if len(mark) == 3 and mark[2] > expires]
+            for file, marks in empty_ranges.items()
+        }
+
+    def resample(self, pair: str, base_timeframe: str, timeframe: str, start_date: datetime = None) -> int:
+        """
+        Build the `timeframe` candles of a pair from its stored `base_timeframe`
+        candles from `start_date` on, the way the exchange aggregates them, and
+        merge them into the store. Candles the base data only partially covers
+        are left out. Returns the number of candles written.
+        """
+        import pandas as pd
+        base_path = self.candle_path(pair, base_timeframe)
+        if not os.path.exists(base_path):
+            return 0
+        base = pd.read_feather(base_path)
+        if start_date is not None:
+            base = base[base["date"] >= candle_open(as_utc(start_date), timeframe)]
+        if base.empty:
+            return 0
+        rule = _resample_rule(timeframe)
+        candles = base.set_index("date").resample(**rule).agg({
+            "open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum",
+        })
+        # Periods without any base candle (exchange downtime) have no candle either
+        candles = candles.dropna(subset=["open"])
+        closes = candles.index + pd.tseries.frequencies.to_offset(rule["rule"])
+        covered = (candles.index >= base["date"].iloc[0]) & (closes <= base["date"].iloc[-1] + timeframe_to_timedelta(base_timeframe))
+        candles = candles[covered].reset_index()
+        if candles.empty:
+            return 0
+        dest = self.candle_path(pair, timeframe)
+        if os.path.exists(dest):
+            old = pd.read_feather(dest)
+            candles = pd.concat([old, candles]).drop_duplicates(subset="date", keep="last")
+            candles = candles.sort_values("date").reset_index(drop=True)
+        _write_feather(candles[["date", "open", "high", "low", "close", "volume"]], dest)
+        return int(covered.sum())
+
+    def merge_from(self, scratch_datadir: str) -> dict[str, int]:
+        """
+        Merge every candle file downloaded into `scratch_datadir` into the store.
+        Returns the number of new candles per store file.
+        """
+        import pandas as pd
+        added = {}
+        for root, _, files in os.walk(scratch_datadir):
+            for file in files:
+                if not file.endswith(f".{self.data_format}"):
+                    continue
+                src = os.path.join(root, file)
+                dest = os.path.join(self.datadir, os.path.relpath(src, scratch_datadir))
+                new = pd.read_feather(src)
+                if os.path.exists(dest):
+                    old = pd.read_feather(dest)
+                    merged = pd.concat([old, new]).drop_duplicates(subset="date", keep="last")
+                    merged = merged.sort_values("date").reset_index(drop=True)
+                else:
+                    old, merged = new.iloc[0:0], new
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                _write_feather(merged, dest)
+                added[dest] = len(merged) - len(old)
+        return added
+
+    @contextmanager
+    def lock(self, keys: list[tuple[str, str]], timeout: int = 3600):
+        """
+        Cross-process write lock on the candle files of the (pair, timeframe)
+        keys, so two workers never download into the same file at once while
+        workers on other pairs go on in parallel.
+        """
+        lock_dir = os.path.join(self.datadir, ".locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with ExitStack() as stack:
+            # Always taken in the same order, two workers can't wait on each other
+            for pair, timeframe in sorted(set(keys)):
+                stack.enter_context(_flock(os.path.join(lock_dir, f"{os.path.basename(self.candle_path(pair, timeframe))}.lock"), timeout))
+            yield
@@ -1,9 +1,23 @@
+import asyncio
 import json
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
 import os
+import time
+from dataclasses import asdict
 from datetime import datetime, timedelta
-from db import get_db, get_ai
-from services.services import add_strategy, process_strategy, add_pair, get_backtesting_to_process, add_backtesting_performances, complete_backtesting
+from db import get_db, get_ai, ping_db, close_db
+from services.candle_store import CandleStore
+from services.candle_downloader import IncrementalDownloader
+from services.download_planner import plan_downloads
+from services.strategy_metadata import scan_strategies
+from services.backtest_results import find_result_files, read_strategy_results
+from services.trade_store import TradeWriter
+from services.indexes import ensure_indexes
+from services.git_sync import diff_mirror, flat_changes, get_synced_commit, set_synced_commit, update_mirror
+from services.llm_pipeline import ANALYSIS_CACHE_COLLECTION, CHECKPOINT_COLLECTION, AnalysisCache, AnalysisPipeline, model_name
+from services.backtest_engine import BACKTEST_ENGINE, get_engine
+from services.services import STRATEGY_PROMPT_VERSION, add_strategy, delete_strategies, process_strategy, add_pair, get_backtesting_to_process, add_backtesting_performances, complete_backtesting
 from bson.objectid import ObjectId
 
 celery_app = Celery(
@@ -12,25 +26,44 @@ celery_app = Celery(
     backend=os.environ.get("REDIS_URL", "redis://localhost:6379/0")
 )
 
+# Once per worker, in the parent process before the pool forks. Its client is
+# closed again so the children do not inherit it
+@worker_init.connect
+def init_indexes(**kwargs):
+    ensure_indexes(get_db())
+    close_db()
+
+# Every task of a worker process shares the process-wide MongoClient from db.get_client
+@worker_process_init.connect
+def init_db_client(**kwargs):
+    ping_db()
+
+@worker_process_shutdown.connect
+def close_db_client(**kwargs):
+    close_db()
+
+# Strategies of a backtesting are split in this many shards, each one a separate
+# freqtrade process picked up by the backtests queue workers. Read where the batch
+# is dispatched, not on the workers: set it to the total concurrency of the
+# backtests queue workers
+BACKTEST_SHARDS = int(os.environ.get("BACKTEST_SHARDS", 4))
+
 @celery_app.task
-def download_data(backtesting_id: str, pairlist: list[str], start_date: datetime, end_date: datetime, timeframe: str = '5m'):
-    print(f"Downloading data for {pairlist} from {start_date} to {end_date}")
-    import subprocess
-    from textwrap import dedent
-    timerange = f"{start_date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')}"
-    pairs = " ".join([pair for pair in pairlist])
-    log_filepath = f"./ftrade_{backtesting_id}/logs/download_data.log"
-    data_folder = f"./ftrade_{backtesting_id}/data"
-    command = dedent(f"""
-        python -m freqtrade download-data --exchange binance --timerange {timerange} 
-        --timeframe {timeframe} 1d -p {pairs} --config ./ftrade_{backtesting_id}/config.json
-        --include-inactive-pairs --trading-mode futures --log-file {log_filepath} --datadir {data_folder} --userdir ./ftrade_{backtesting_id}
-    """).strip().replace("\n", " ")
-    print(f"Running command: {command}")
-    res = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=1800)
-    print(f"Result: {res.returncode}")
-    print(res.stderr)
-    print(res.stdout)
+def download_data(backtesting_id: str, downloads: list[dict]):
+    from dateutil import parser
+    windows = {
+        (download['pair'], download['timeframe']): (parser.isoparse(download['start_date']), parser.isoparse(download['end_date']))
+        for download in downloads
+    }
+    print(f"Downloading data for {len(windows)} pair / timeframe windows")
+    downloader = IncrementalDownloader(
+        CandleStore(),
+        config_filepath=f"./ftrade_{backtesting_id}/config.json",
+        log_filepath=f"./ftrade_{backtesting_id}/logs/download_data.log",
+        userdir=f"./ftrade_{backtesting_id}",
+    )
+    report = downloader.download_windows(windows)
+    return asdict(report)
 
 @celery_app.task
 def fetch_pairs():
@@ -57,74 +90,77 @@ def fetch_pairs():
 def fetch_strategies():
     print("Fetching strategies")
     import os
-    import glob
-    from textwrap import dedent
     import shutil
-    result_folder = f'./ftrade/strategies_{str(datetime.today().strftime("%Y%m%d"))}/'
+    mirror_folder = './ftrade/strategies_repo/'
     target_folder = './ftrade/strategies/'
-    # Create the result folder
-    if not os.path.exists(result_folder) or not os.listdir(result_folder):
-        os.makedirs(result_folder, exist_ok=True)
-        temp_folder = './ftrade/temp/'
-        clone_command = dedent(f"""
-            git clone -b {os.environ.get('STRATEGIES_BRANCH')} {os.environ.get('STRATEGIES_REPO')} {temp_folder}
-        """).strip().replace("\n", " ")
-        print(f"Running command: {clone_command}")
-        res = os.system(clone_command)
-        os.system(f'cp -r {temp_folder}strategies/* {result_folder}')
-        os.system(f"rm -rf {temp_folder}")
-        print(f"Result: {res}")
-    
-    shutil.rmtree(target_folder, ignore_errors=True)
-    os.makedirs(target_folder, exist_ok=True)
-    os.system(f"cp -r {result_folder}* {target_folder}")
-    # shutil.rmtree(result_folder, ignore_errors=True)
-    
-    strategy_files = [f for f in glob.glob(f'{target_folder}*.py')]
     db = get_db()
+    head = update_mirror(os.environ.get('STRATEGIES_REPO'), os.environ.get('STRATEGIES_BRANCH'), mirror_folder)
+    changes = diff_mirror(mirror_folder, 'strategies', get_synced_commit(db, 'fetch_strategies'), head)
+    if changes.empty:
+        print(f"Strategies already synced at {head}")
+        return {"commit": head, "changed": 0, "deleted": 0}
+    print(f"Syncing {head}: {len(changes.changed)} added or modified, {len(changes.deleted)} deleted{' (full sync)' if changes.full else ''}")
+
+    # Same flattening and deletions as the fetch_strategies_from_github script
+    files, deleted = flat_changes(mirror_folder, 'strategies', changes, db.get_collection('strategies').distinct('filename'))
+    if changes.full:
+        shutil.rmtree(target_folder, ignore_errors=True)
+    os.makedirs(target_folder, exist_ok=True)
+    strategy_codes = {}
+    for filename, path in files.items():
+        shutil.copy2(os.path.join(mirror_folder, path), os.path.join(target_folder, filename))
+        with open(os.path.join(target_folder, filename), 'r', encoding='utf-8') as f:
+            strategy_codes[filename] = f.read()
+    for filename in deleted:
+        if os.path.exists(os.path.join(target_folder, filename)):
+            os.remove(os.path.join(target_folder, filename))
+    if deleted:
+        print(f"Deleted {delete_strategies(db, [filename.replace('.py', '') for filename in deleted])} strategies")
+
     llm = get_ai('openai')
-    print(f"Found {len(strategy_files)} strategies")
-    for i, strategy_file in enumerate(strategy_files):
-        with open(strategy_file, 'r', encoding='utf-8') as f:
-            strategy_code = f.read()
-            print(f"Processing strategy {i}: {strategy_file}")
-            result = process_strategy(llm, strategy_code)
-            result = result.model_dump()
-            strategy = {
-                "name": os.path.basename(strategy_file).replace(".py", ""),
-                "filename": os.path.basename(strategy_file),
-                "indicators": result.get('Indicators', []),
-                "explanation": result.get('Explanation', ''),
-                "example": result.get('Example', ''),
-                "description": result.get('Analyze', ''),
-                "analysis": result
-            }
-            print(f"Adding strategy: {strategy.get('name')}")
-            add_strategy(db, strategy)
-    return "Strategies fetched"
 
-def analyze_results(backtesting_id: str):
-    import glob
-    import json
+    def save_strategy(filename: str, result: dict):
+        strategy = {
+            "name": filename.replace(".py", ""),
+            "filename": filename,
+            "indicators": result.get('Indicators', []),
+            "explanation": result.get('Explanation', ''),
+            "example": result.get('Example', ''),
+            "description": result.get('Analyze', ''),
+            "analysis": result
+        }
+        print(f"Adding strategy: {strategy.get('name')}")
+        add_strategy(db, strategy)
+
+    # One run per synced commit, a retried task resumes where the previous one stopped.
+    # Strategies whose code did not change since their last analysis are not sent again
+    pipeline = AnalysisPipeline(
+        lambda strategy_code: process_strategy(llm, strategy_code).model_dump(),
+        db.get_collection(CHECKPOINT_COLLECTION),
+        run_id=f"fetch_strategies_{head}",
+        cache=AnalysisCache(db.get_collection(ANALYSIS_CACHE_COLLECTION), STRATEGY_PROMPT_VERSION, model_name(llm)),
+    )
+    report = asyncio.run(pipeline.run(strategy_codes, save_strategy))
+    print(f"Strategies analyzed: {report}")
+    # Failed analyses are retried by the next sync of the same commit
+    if not report["failed"]:
+        set_synced_commit(db, 'fetch_strategies', head)
+    return {**report, "commit": head, "changed": len(files), "deleted": len(deleted)}
+
+def analyze_results(backtesting_id: str, trade_sink=None, result_names: list[str] = None):
     results = []
-    result_folder = f'./ftrade/backtest_results/backtesting_{backtesting_id}'
-    result_files = [f for f in glob.glob(f'{result_folder}*.json') if not f.endswith('.meta.json')]
+    # One result file per backtest shard, only the shards of this run when named
+    result_folder = f'./ftrade_{backtesting_id}/backtest_results'
+    result_files = [
+        result_file
+        for result_name in result_names or [f'backtesting_{backtesting_id}']
+        for result_file in find_result_files(f'{result_folder}/{result_name}')
+    ]
     print(f"Found {len(result_files)} result files")
     for result in result_files:
-        with open(result, 'r') as f:
-            data = json.load(f)
-            if not data:
-                continue
-            summary = data.get('strategy', {})
-            
-            strategies = summary.keys()
-            print(f"Found {len(strategies)} strategies")
-            for strategy in strategies:
-                d = summary.get(strategy, {})
-                results.append({
-                    'key': strategy,
-                    'details': d,
-                })
+        strategies = read_strategy_results(result, trade_sink)
+        print(f"Found {len(strategies)} strategies")
+        results.extend(strategies)
     # Remove the result files
     # for f in glob.glob(f'{result_folder}*'):
     #     os.remove(f)
@@ -173,7 +209,7 @@ def init_config(pairs: list[str]):
     }
     return config
 
-def run_backtest(id: str, strategies: list[str], pairs: list[str], start_date: datetime, end_date: datetime, timeframe: str):
+def run_backtest(id: str, strategies: list[str], pairs: list[str], start_date: datetime, end_date: datetime, timeframe: str, result_name: str = None):
     print(f"Running backtesting for {strategies} on {pairs} from {start_date} to {end_date} with timeframe {timeframe}")
     from textwrap import dedent
     import subprocess
@@ -181,16 +217,18 @@ def run_backtest(id: str, strategies: list[str], pairs: list[str], start_date: d
     pairs = " ".join([pair for pair in pairs])
     timerange = f"{start_date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')}"
     ftrade_dir = f"ftrade_{id}"
-    result_file = f"./{ftrade_dir}/backtest_results/backtesting_{id}.json"
-    log_file = f"./{ftrade_dir}/logs/backtesting_{id}.log"
+    result_name = result_name or f"backtesting_{id}"
+    result_file = f"./{ftrade_dir}/backtest_results/{result_name}.json"
+    log_file = f"./{ftrade_dir}/logs/{result_name}.log"
     
     # command = dedent(f"""
     #     freqtrade backtesting --strategy-list {strategies} --pairs {pairs} --datadir ./ftrade/data
     #     --timerange {timerange} --backtest-filename {result_file} --logfile {log_file}
     #     --export trades --timeframe {timeframe} --config ./ftrade/config.json --userdir ./ftrade
     # """).strip().replace("\n", " ")
+    datadir = CandleStore().datadir
     command = dedent(f"""
-        freqtrade backtesting --strategy-list {strategies} --pairs {pairs} --datadir ./{ftrade_dir}/data
+        freqtrade backtesting --strategy-list {strategies} --pairs {pairs} --datadir {datadir}
         --timerange {timerange} --backtest-filename {result_file} --logfile {log_file}
         --export trades --timeframe {timeframe} --config ./{ftrade_dir}/config.json --userdir ./{ftrade_dir}
     """).strip().replace("\n", " ")
@@ -199,10 +237,180 @@ def run_backtest(id: str, strategies: list[str], pairs: list[str], start_date: d
     print(res.returncode)
     # os.remove(log_file)
     print(f"Result: {res}")
+    return res
+
+def run_backtest_inprocess(id: str, strategies: list[str], pairs: list[str], start_date: datetime, end_date: datetime, timeframe: str, result_name: str = None):
+    print(f"Running in-process backtesting for {strategies} on {pairs} from {start_date} to {end_date} with timeframe {timeframe}")
+    ftrade_dir = f"ftrade_{id}"
+    result_name = result_name or f"backtesting_{id}"
+    return get_engine().run(
+        config_filepath=f"./{ftrade_dir}/config.json",
+        userdir=f"./{ftrade_dir}",
+        datadir=CandleStore().datadir,
+        strategies=strategies,
+        pairs=pairs,
+        timerange=f"{start_date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')}",
+        timeframe=timeframe,
+        result_file=f"./{ftrade_dir}/backtest_results/{result_name}.json",
+        log_file=f"./{ftrade_dir}/logs/{result_name}.log",
+    )
+
+def build_performances(results: list[dict], strategies: list[dict], start_date: datetime, end_date: datetime):
+    strategies_by_name = {strategy['name']: strategy for strategy in strategies}
+    performances = []
+    for performance in results:
+        strategy = strategies_by_name.get(performance.get('key'))
+        if not strategy:
+            continue
+        details = performance.get('details', {})
+        performances.append({
+            'strategy_id': strategy.get('_id'),
+            'strategy_name': strategy.get('name'),
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'wins': details.get('wins', 0),
+            'losses': details.get('losses', 0),
+            'draws': details.get('draws', 0),
+            'total_trades': details.get('total_trades', 0),
+            'trade_per_day': details.get('trades_per_day', 0),
+            'profit': details.get('profit_total_abs', 0),
+            'starting_balance': details.get('starting_balance', 0),
+            'stop_loss': details.get('stoploss', 0),
+            'avg_duration': details.get('holding_avg_s', 0),
+            'final_balance': details.get('final_balance', 0),
+            'max_drawdown': details.get('max_drawdown_abs', 0),
+            'profit_percentage': details.get('profit_total', 0) * 100,
+            'avg_profit_percentage': details.get('profit_mean', 0) * 100,
+            'win_rate': details.get('winrate', 0),
+            'profit_factor': details.get('profit_factor', 0),
+        })
+
+    if not performances:
+        print("No performance data found, creating empty results")
+        # Create empty performance records for each strategy
+        for strategy in strategies:
+            performances.append({
+                'strategy_id': strategy.get('_id'),
+                'strategy_name': strategy.get('name'),
+                'start_date': start_date.strftime('%Y-%m-%d'),
+                'end_date': end_date.strftime('%Y-%m-%d'),
+                'wins': 0,
+                'losses': 0,
+                'draws': 0,
+                'total_trades': 0,
+                'trade_per_day': 0,
+                'profit': 0,
+                'starting_balance': 0,
+                'stop_loss': 0,
+                'avg_duration': 0,
+                'final_balance': 0,
+                'max_drawdown': 0,
+                'profit_percentage': 0,
+                'avg_profit_percentage': 0,
+                'win_rate': 0,
+                'profit_factor': 0,
+            })
+    return performances
+
+# A backtesting runs as a chain of stages, each on its own queue, so I/O bound
+# download workers and CPU bound backtest workers are scaled independently and
+# the download of the next job overlaps with the backtest of the current one:
+#   celery -A services.celery_service worker -Q downloads -c 8
+#   celery -A services.celery_service worker -Q backtests
+#   celery -A services.celery_service worker -Q results,celery
+# With BACKTEST_ENGINE=inprocess the backtests workers keep freqtrade and the
+# loaded candles in memory between jobs instead of spawning freqtrade each time.
+celery_app.conf.update(
+    task_routes={
+        "services.celery_service.download_stage": {"queue": "downloads"},
+        "services.celery_service.backtest_stage": {"queue": "backtests"},
+        "services.celery_service.analyze_stage": {"queue": "results"},
+        "services.celery_service.persist_stage": {"queue": "results"},
+    },
+    # Stages are long running, don't let one worker reserve jobs another idle worker could start
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+)
+
+@celery_app.task
+def download_stage(job: dict):
+    print(f"Downloading market data for backtesting {job['id']}...")
+    job['download'] = download_data(job['id'], job['downloads'])
+    return job
+
+@celery_app.task
+def backtest_stage(job: dict, shard: int = 0, shards: int = 1):
+    from dateutil import parser
+    strategies = [strategy['name'] for strategy in job['strategies'][shard::shards]]
+    print(f"Running backtest {job['id']} shard {shard + 1}/{shards} with {len(strategies)} strategies...")
+    started = time.time()
+    args = (job['id'], strategies, job['pairs'], parser.isoparse(job['start_date']), parser.isoparse(job['end_date']), job['timeframe'])
+    # Same width for every shard, so no shard name is a prefix of another one
+    result_name = f"backtesting_{job['id']}_shard{shard:0{len(str(shards))}d}"
+    # Left by an earlier attempt of this task
+    for result_file in find_result_files(f"./ftrade_{job['id']}/backtest_results/{result_name}"):
+        os.remove(result_file)
+    if BACKTEST_ENGINE == "inprocess":
+        run_backtest_inprocess(*args, result_name=result_name)
+    else:
+        res = run_backtest(*args, result_name=result_name)
+        if res.returncode != 0:
+            raise RuntimeError(f"freqtrade backtesting exited with {res.returncode}: {res.stderr[-1000:]}")
+    seconds = round(time.time() - started, 2)
+    print(f"Backtest {job['id']} shard {shard + 1}/{shards} took {seconds}s")
+    return {**job, 'result_names': [result_name], 'timings': [{'shard': shard, 'strategies': strategies, 'seconds': seconds}]}
+
+@celery_app.task
+def analyze_stage(shard_jobs: list[dict]):
+    from dateutil import parser
+    # Called once all shards are done, with the job returned by each of them
+    if isinstance(shard_jobs, dict):
+        shard_jobs = [shard_jobs]
+    job = dict(shard_jobs[0])
+    job['result_names'] = [result_name for shard_job in shard_jobs for result_name in shard_job.get('result_names', [])]
+    job['timings'] = sorted([timing for shard_job in shard_jobs for timing in shard_job.get('timings', [])], key=lambda t: t['shard'])
+    print(f"Analyzing results of backtesting {job['id']}...")
+    trade_writer = TradeWriter(get_db(), job['id'], {strategy['name']: strategy.get('_id') for strategy in job['strategies']})
+    result = analyze_results(job['id'], trade_writer, job['result_names'])
+    trade_writer.flush()
+    print(f"Stored {trade_writer.written} trades")
+    job['performances'] = build_performances(result, job['strategies'], parser.isoparse(job['start_date']), parser.isoparse(job['end_date']))
+    return job
+
+@celery_app.task
+def persist_stage(job: dict):
+    db = get_db()
+    performances = job['performances']
+    # Save performance results
+    performance_ids = add_backtesting_performances(db, performances)
+    performance_ids_str = [str(pid) for pid in performance_ids]
+
+    # Mark backtesting as completed
+    complete_backtesting(db, job['id'], performance_ids_str, job.get('timings'))
+
+    print(f"Backtesting {job['id']} completed successfully with {len(performances)} performance records")
+    return f"Backtesting completed with {len(performances)} results"
+
+@celery_app.task
+def mark_backtesting_failed(request, exc, traceback, backtesting_id: str):
+    # Error callback of the stage chain
+    print(f"ERROR: Backtesting {backtesting_id} failed: {str(exc)}")
+    try:
+        get_db().get_collection("backtestings").update_one({
+            "_id": ObjectId(backtesting_id)
+        }, {
+            "$set": {
+                "status": "failed",
+                "error_message": str(exc)
+            }
+        })
+    except Exception as db_error:
+        print(f"Failed to update backtesting status: {str(db_error)}")
 
 @celery_app.task
 def start_backtesting_batch(backtesting_id: str):
     print(f"Running backtesting for {backtesting_id}")
+    from celery import chain, group
     from dateutil import parser
     import shutil
     
@@ -222,7 +430,8 @@ def start_backtesting_batch(backtesting_id: str):
         # Extract backtesting parameters
         pairs = backtesting.get('pairs', [])
         strategies = backtesting.get('strategies', [])
-        start_date = parser.isoparse(backtesting.get('start_date')) - timedelta(days=2)
+        start_date = parser.isoparse(backtesting.get('start_date'))
+        # The timerange stops at the midnight opening end_date, include that day
         end_date = parser.isoparse(backtesting.get('end_date')) + timedelta(days=1)
         timeframe = backtesting.get('timeframe', '5m')
         
@@ -247,98 +456,39 @@ def start_backtesting_batch(backtesting_id: str):
         os.makedirs(f"ftrade_{backtesting_id}/strategies", exist_ok=True)
         for strategy in strategies:
             shutil.copy(f"strategies/{strategy.get('name')}.py", f"ftrade_{backtesting_id}/strategies/{strategy.get('name')}.py")
+        # Results of an earlier run of this backtesting must not be merged again
+        shutil.rmtree(f"ftrade_{backtesting_id}/backtest_results", ignore_errors=True)
+        os.makedirs(f"ftrade_{backtesting_id}/backtest_results", exist_ok=True)
+        # Shared code imported by the strategies
+        shutil.copytree("strategies/strategy_helpers", f"ftrade_{backtesting_id}/strategies/strategy_helpers", dirs_exist_ok=True, ignore=shutil.ignore_patterns("__pycache__"))
+        # Candles to download, from each strategy's startup candles and informative timeframes
+        # A handful of files, parsed in this worker process
+        metadata = scan_strategies([f"ftrade_{backtesting_id}/strategies/{strategy.get('name')}.py" for strategy in strategies], max_workers=1)
+        windows = plan_downloads(metadata, pairs, timeframe, start_date, end_date)
 
-        # Download data
-        print("Downloading market data...")
-        download_data(backtesting_id, pairs, start_date, end_date, timeframe)
-        return "Data downloaded"
-        # Run backtest
-        print("Running backtest...")
-        run_backtest(backtesting_id, [strategy['name'] for strategy in strategies], pairs, start_date, end_date, timeframe)
-        
-        # Analyze results
-        print("Analyzing results...")
-        result = analyze_results(backtesting_id)
-        
-        # Process performance data
-        performances = []
-        for performance in result:
-            for strategy in strategies:
-                if strategy['name'] == performance.get('key'):
-                    performances.append({
-                        'strategy_id': strategy.get('_id'),
-                        'strategy_name': strategy.get('name'),
-                        'start_date': start_date.strftime('%Y-%m-%d'),
-                        'end_date': end_date.strftime('%Y-%m-%d'),
-                        'wins': performance.get('details', {}).get('wins', 0),
-                        'losses': performance.get('details', {}).get('losses', 0),
-                        'draws': performance.get('details', {}).get('draws', 0),
-                        'total_trades': performance.get('details', {}).get('total_trades', 0),
-                        'trade_per_day': performance.get('details', {}).get('trades_per_day', 0),
-                        'profit': performance.get('details', {}).get('profit_total_abs', 0),
-                        'starting_balance': performance.get('details', {}).get('starting_balance', 0),
-                        'stop_loss': performance.get('details', {}).get('stoploss', 0),
-                        'avg_duration': performance.get('details', {}).get('holding_avg_s', 0),
-                        'final_balance': performance.get('details', {}).get('final_balance', 0),
-                        'max_drawdown': performance.get('details', {}).get('max_drawdown_abs', 0),
-                        'profit_percentage': performance.get('details', {}).get('profit_total', 0) * 100,
-                        'avg_profit_percentage': performance.get('details', {}).get('profit_mean', 0) * 100,
-                        'win_rate': performance.get('details', {}).get('winrate', 0),
-                    })
-                    break
-        
-        if not performances:
-            print("No performance data found, creating empty results")
-            # Create empty performance records for each strategy
-            for strategy in strategies:
-                performances.append({
-                    'strategy_id': strategy.get('_id'),
-                    'strategy_name': strategy.get('name'),
-                    'start_date': start_date.strftime('%Y-%m-%d'),
-                    'end_date': end_date.strftime('%Y-%m-%d'),
-                    'wins': 0,
-                    'losses': 0,
-                    'draws': 0,
-                    'total_trades': 0,
-                    'trade_per_day': 0,
-                    'profit': 0,
-                    'starting_balance': 0,
-                    'stop_loss': 0,
-                    'avg_duration': 0,
-                    'final_balance': 0,
-                    'max_drawdown': 0,
-                    'profit_percentage': 0,
-                    'avg_profit_percentage': 0,
-                    'win_rate': 0,
-                })
-        
-        # Save performance results
-        performance_ids = add_backtesting_performances(db, performances)
-        performance_ids_str = [str(pid) for pid in performance_ids]
-        
-        # Mark backtesting as completed
-        complete_backtesting(db, backtesting_id, performance_ids_str)
-        
-        print(f"Backtesting {backtesting_id} completed successfully with {len(performances)} performance records")
-        return f"Backtesting completed with {len(performances)} results"
+        job = {
+            'id': backtesting_id,
+            'pairs': pairs,
+            'strategies': strategies,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'timeframe': timeframe,
+            'downloads': [
+                {'pair': pair, 'timeframe': window_timeframe, 'start_date': window_start.isoformat(), 'end_date': window_end.isoformat()}
+                for (pair, window_timeframe), (window_start, window_end) in windows.items()
+            ],
+        }
+        shards = max(1, min(BACKTEST_SHARDS, len(strategies)))
+        workflow = chain(
+            download_stage.s(job),
+            group(backtest_stage.s(shard, shards) for shard in range(shards)),
+            analyze_stage.s(),
+            persist_stage.s(),
+        ).on_error(mark_backtesting_failed.s(backtesting_id))
+        workflow.apply_async()
+        return "Backtesting queued"
         
     except Exception as e:
-        # Log the error
-        error_msg = f"Backtesting {backtesting_id} failed: {str(e)}"
-        print(f"ERROR: {error_msg}")
-        
-        # Update backtesting status to failed
-        try:
-            db.get_collection("backtestings").update_one({
-                "_id": ObjectId(backtesting_id)
-            }, {
-                "$set": {
-                    "status": "failed",
-                    "error_message": str(e)
-                }
-            })
-        except Exception as db_error:
-            print(f"Failed to update backtesting status: {str(db_error)}")
-        
+        mark_backtesting_failed(None, e, None, backtesting_id)
         # Re-raise the exception so Celery can handle it
-        raise e
\ No newline at end of file
+        raise e
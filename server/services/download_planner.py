@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from services.candle_store import as_utc, candle_open, timeframe_to_timedelta
+from services.strategy_metadata import STRATEGY_TIMEFRAME, StrategyMetadata
+
+# Extra candle before the startup ones, informative candles are merged from the previous closed one
+MARGIN_CANDLES = 1
+# Warm-up and informative timeframe kept for strategies that cannot be read statically,
+# the fixed padding downloaded before the plan existed
+FALLBACK_STARTUP = timedelta(days=2)
+FALLBACK_TIMEFRAME = "1d"
+
+Window = tuple[datetime, datetime]
+
+
+def backtest_timerange(start_date: datetime, end_date: datetime) -> Window:
+    # --timerange is given in days (YYYYMMDD-YYYYMMDD), from the first midnight to the last one
+    return candle_open(as_utc(start_date), "1d"), candle_open(as_utc(end_date), "1d")
+
+
+def plan_downloads(strategies: list[StrategyMetadata], pairs: list[str], timeframe: str, start_date: datetime, end_date: datetime) -> dict[tuple[str, str], Window]:
+    """
+    Smallest (pair, timeframe) -> (start, end) windows covering the backtest
+    of `strategies` on `pairs`: the timerange plus the startup candles freqtrade
+    loads before it, on the run timeframe and on every informative timeframe.
+    """
+    start_date, end_date = backtest_timerange(start_date, end_date)
+    windows = {}
+
+    def add(pair: str, window_timeframe: str, warmup: timedelta):
+        start = candle_open(start_date - warmup, window_timeframe)
+        current = windows.get((pair, window_timeframe))
+        windows[(pair, window_timeframe)] = (min(start, current[0]) if current else start, end_date)
+
+    def startup(metadata: StrategyMetadata, window_timeframe: str) -> timedelta:
+        count = metadata.attributes.get("startup_candle_count", 0)
+        if metadata.error or not isinstance(count, int):
+            return FALLBACK_STARTUP
+        return (count + MARGIN_CANDLES) * timeframe_to_timedelta(window_timeframe)
+
+    for metadata in strategies:
+        informative = list(metadata.informative)
+        if metadata.error or not metadata.is_strategy or any(tf is None for _, tf in informative):
+            print(f"Cannot read the informative timeframes of {metadata.filename}, adding {FALLBACK_TIMEFRAME}")
+            informative.append((None, FALLBACK_TIMEFRAME))
+        for pair in pairs:
+            add(pair, timeframe, startup(metadata, timeframe))
+        for informative_pair, informative_timeframe in informative:
+            if informative_timeframe is None:
+                continue
+            informative_timeframe = timeframe if informative_timeframe == STRATEGY_TIMEFRAME else informative_timeframe
+            for pair in [informative_pair] if informative_pair else pairs:
+                add(pair, informative_timeframe, startup(metadata, informative_timeframe))
+    return windows
@@ -0,0 +1,117 @@
+import os
+import subprocess
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from pymongo.database import Database
+
+SYNC_COLLECTION = "sync_state"
+
+
+@dataclass
+class RepoChanges:
+    head: str
+    # None when there is no usable last synced commit, `changed` is then every file
+    base: str | None
+    changed: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+
+    @property
+    def full(self) -> bool:
+        return self.base is None
+
+    @property
+    def empty(self) -> bool:
+        return not self.full and not self.changed and not self.deleted
+
+
+def _git(*args, cwd: str = None, timeout: int = 300) -> str:
+    result = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def update_mirror(repo_url: str, branch: str, mirror_dir: str) -> str:
+    """
+    Bring the persistent clone in `mirror_dir` to the tip of `branch`,
+    cloning it the first time. Returns the new head commit.
+    """
+    if os.path.isdir(os.path.join(mirror_dir, ".git")):
+        print(f"Fetching {branch} into {mirror_dir}")
+        _git("fetch", "origin", branch, cwd=mirror_dir)
+        _git("reset", "--hard", "FETCH_HEAD", cwd=mirror_dir)
+    else:
+        print(f"Cloning {repo_url} ({branch}) into {mirror_dir}")
+        # Full history, the next sync diffs against the commit synced now
+        _git("clone", "--single-branch", "-b", branch, repo_url, mirror_dir)
+    return _git("rev-parse", "HEAD", cwd=mirror_dir).strip()
+
+
+def _has_commit(mirror_dir: str, commit: str) -> bool:
+    try:
+        _git("cat-file", "-e", f"{commit}^{{commit}}", cwd=mirror_dir)
+        return True
+    except RuntimeError:
+        return False
+
+
+def _is_strategy(path: str, folder: str) -> bool:
+    name = os.path.basename(path)
+    return path.startswith(f"{folder.rstrip('/')}/") and name.endswith(".py") and not name.startswith("__")
+
+
+def diff_mirror(mirror_dir: str, folder: str, base: str | None, head: str) -> RepoChanges:
+    """
+    Strategy files under `folder` added, modified or deleted between `base`
+    and `head`, paths relative to the mirror. Renames count as a deletion
+    plus an addition.
+    """
+    if not base or not _has_commit(mirror_dir, base):
+        files = _git("ls-files", "-z", "--", folder, cwd=mirror_dir).split("\0")
+        return RepoChanges(head, None, [path for path in files if _is_strategy(path, folder)])
+    changes = RepoChanges(head, base)
+    # -z output alternates status and path
+    entries = _git("diff", "--name-status", "--no-renames", "-z", base, head, "--", folder, cwd=mirror_dir).split("\0")
+    for status, path in zip(entries[0::2], entries[1::2]):
+        if not _is_strategy(path, folder):
+            continue
+        if status == "D":
+            changes.deleted.append(path)
+        else:
+            changes.changed.append(path)
+    return changes
+
+
+def flat_changes(mirror_dir: str, folder: str, changes: RepoChanges, synced: list[str]) -> tuple[dict[str, str], list[str]]:
+    """
+    Strategies are synced flat into one directory by file name. Returns the
+    file name -> path of the files to copy for `changes`, and the file names
+    to delete: the deleted ones, or on a full sync every `synced` file name
+    gone from the repository. Nested paths sharing a file name are reported
+    and only the shallowest one, then the first in path order, is synced.
+    """
+    files = [path for path in _git("ls-files", "-z", "--", folder, cwd=mirror_dir).split("\0") if _is_strategy(path, folder)]
+    paths = {}
+    for path in sorted(files, key=lambda path: (path.count("/"), path)):
+        filename = os.path.basename(path)
+        if filename in paths:
+            print(f"Skipping {path}, {filename} is synced from {paths[filename]}")
+            continue
+        paths[filename] = path
+    if changes.full:
+        return paths, [filename for filename in synced if filename and filename not in paths]
+    # A deleted or changed path may hand its file name over to another one
+    touched = {os.path.basename(path) for path in [*changes.changed, *changes.deleted]}
+    return {filename: paths[filename] for filename in touched if filename in paths}, [filename for filename in touched if filename not in paths]
+
+
+def get_synced_commit(db: Database, key: str) -> str | None:
+    res = db.get_collection(SYNC_COLLECTION).find_one({"_id": key})
+    return res["commit"] if res else None
+
+
+def set_synced_commit(db: Database, key: str, commit: str):
+    db.get_collection(SYNC_COLLECTION).update_one(
+        {"_id": key}, {"$set": {"commit": commit, "synced_at": datetime.now(timezone.utc)}}, upsert=True
+    )
@@ -0,0 +1,127 @@
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+# Every index the services rely on. The $lookup of get_backtesting_to_process
+# joins on _id, which is always indexed.
+INDEXES = {
+    "strategies": [
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+        IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id"),
+    ],
+    "pairs": [
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+        IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id"),
+    ],
+    "backtestings": [
+        IndexModel([("status", ASCENDING), ("_id", ASCENDING)], name="status_id"),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease"),
+        IndexModel([("start_date", ASCENDING), ("_id", ASCENDING)], name="start_date_id"),
+    ],
+    "strategy_performances": [
+        IndexModel([("strategy_id", ASCENDING), ("end_date", ASCENDING)], name="strategy_end_date"),
+    ],
+    "strategy_rollups": [
+        IndexModel([("timeframe", ASCENDING), ("pair_group_id", ASCENDING)], name="timeframe_pair_group"),
+    ],
+    "analysis_checkpoints": [
+        IndexModel([("run_id", ASCENDING), ("key", ASCENDING)], name="run_key", unique=True),
+    ],
+    "backtest_trades": [
+        IndexModel([("backtesting_id", ASCENDING), ("strategy_name", ASCENDING), ("open_date", ASCENDING)], name="backtesting_strategy_open_date"),
+        IndexModel([("backtesting_id", ASCENDING), ("pair", ASCENDING), ("open_date", ASCENDING)], name="backtesting_pair_open_date"),
+        IndexModel([("strategy_name", ASCENDING), ("pair", ASCENDING), ("open_date", ASCENDING)], name="strategy_pair_open_date"),
+    ],
+}
+
+
+def ensure_indexes(db: Database):
+    """
+    Create missing indexes, existing ones are left untouched so this is
+    cheap enough to run on every app / worker start.
+    """
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                db.get_collection(collection).create_indexes([index])
+            except OperationFailure as e:
+                # e.g. duplicated names from an old import, clean them up and restart
+                print(f"Failed to create index {index.document['name']} on {collection}: {e}")
+
+
+def _queries(db: Database):
+    # The queries of services.py, with placeholder values
+    some_id = ObjectId()
+    backtestings = db.get_collection("backtestings")
+    strategies = db.get_collection("strategies")
+    pairs = db.get_collection("pairs")
+    trades = db.get_collection("backtest_trades")
+    return {
+        "get_backtestings": lambda: backtestings.find({}).sort([("_id", ASCENDING)]).limit(100).explain(),
+        "get_backtestings sort=start_date": lambda: backtestings.find({}).sort([("start_date", ASCENDING), ("_id", ASCENDING)]).limit(100).explain(),
+        "get_backtesting": lambda: backtestings.find({"_id": some_id}).explain(),
+        "get_backtesting_to_process": lambda: db.command("aggregate", "backtestings", pipeline=[
+            {"$match": {"_id": some_id}},
+            {"$lookup": {"from": "pair_groups", "localField": "pair_group_id", "foreignField": "_id", "as": "pair_group"}},
+            {"$lookup": {"from": "strategies", "localField": "strategy_id", "foreignField": "_id", "as": "strategy"}},
+            {"$addFields": {"strategy_ids": {"$map": {"input": {"$ifNull": ["$strategies", []]}, "in": {"$toObjectId": "$$this"}}}}},
+            {"$lookup": {"from": "strategies", "localField": "strategy_ids", "foreignField": "_id", "as": "batch_strategies"}},
+        ], explain=True),
+        "pending backtestings": lambda: backtestings.find({"status": "pending"}).sort([("_id", ASCENDING)]).explain(),
+        "get_backtesting_performance": lambda: db.get_collection("strategy_performances").find({"_id": {"$in": [some_id]}}).explain(),
+        "strategy performances": lambda: db.get_collection("strategy_performances").find({"strategy_id": some_id}).explain(),
+        "get_backtesting_trades": lambda: trades.find({"backtesting_id": some_id, "strategy_name": "x"}).sort([("open_date", ASCENDING)]).limit(100).explain(),
+        "get_backtesting_trades pair": lambda: trades.find({"backtesting_id": some_id, "pair": "x"}).sort([("open_date", ASCENDING)]).limit(100).explain(),
+        "get_backtesting_trade_stats": lambda: db.command("aggregate", "backtest_trades", pipeline=[
+            {"$match": {"backtesting_id": some_id}},
+            {"$group": {"_id": "$pair", "total_trades": {"$sum": 1}}},
+        ], explain=True),
+        "get_strategies": lambda: strategies.find({}, {"name": 1}).sort([("_id", ASCENDING)]).limit(100).explain(),
+        "get_strategies sort=name": lambda: strategies.find({}, {"name": 1}).sort([("name", ASCENDING), ("_id", ASCENDING)]).limit(100).explain(),
+        "get_strategy": lambda: strategies.find({"_id": some_id}).explain(),
+        "add_strategy": lambda: strategies.find({"name": "x"}).explain(),
+        "get_pairs": lambda: pairs.find({}, {"name": 1}).sort([("_id", ASCENDING)]).limit(100).explain(),
+        "get_pairs sort=name": lambda: pairs.find({}, {"name": 1}).sort([("name", ASCENDING), ("_id", ASCENDING)]).limit(100).explain(),
+        "add_pair": lambda: pairs.find({"name": "x"}).explain(),
+        "get_leaderboard": lambda: db.command("aggregate", "strategy_rollups", pipeline=[
+            {"$match": {"timeframe": {"$in": ["5m"]}}},
+            {"$group": {"_id": "$strategy_id", "backtests": {"$sum": "$backtests"}}},
+        ], explain=True),
+    }
+
+
+def _plan_stages(node):
+    # Stages of the winning plans anywhere in an explain() output
+    if isinstance(node, dict):
+        if "stage" in node:
+            yield node["stage"]
+        for key, value in node.items():
+            if key != "rejectedPlans":
+                yield from _plan_stages(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _plan_stages(value)
+
+
+def explain_queries(db: Database) -> dict[str, list[str]]:
+    """
+    explain() every services query and return its plan stages, queries
+    scanning a whole collection are flagged with COLLSCAN.
+    """
+    plans = {}
+    for name, explain in _queries(db).items():
+        stages = list(_plan_stages(explain()))
+        plans[name] = stages
+        print(f"{'COLLSCAN' if 'COLLSCAN' in stages else 'ok':<8} {name}: {' <- '.join(stages)}")
+    return plans
+
+
+if __name__ == "__main__":
+    # cd server && python -m services.indexes
+    from db import get_db
+    db = get_db()
+    ensure_indexes(db)
+    plans = explain_queries(db)
+    scans = [name for name, stages in plans.items() if "COLLSCAN" in stages]
+    print(f"{len(scans)} of {len(plans)} queries scan a whole collection")
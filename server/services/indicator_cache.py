@@ -0,0 +1,185 @@
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import time
+
+INDICATOR_CACHE_DIR = os.environ.get("INDICATOR_CACHE_DIR", "./ftrade/indicators")
+INDICATOR_CACHE_SIZE_MB = int(os.environ.get("INDICATOR_CACHE_SIZE_MB", 2048))
+# Seconds between two size checks of the cache directory
+INDICATOR_CACHE_EVICT_SECONDS = float(os.environ.get("INDICATOR_CACHE_EVICT_SECONDS", 300))
+# Serve the first candles of a longer cached frame. Only correct when every
+# indicator of every strategy is causal, off unless the strategies are known to be
+INDICATOR_CACHE_PREFIX_REUSE = os.environ.get("INDICATOR_CACHE_PREFIX_REUSE", "0") == "1"
+# Package of code shared by the strategies, next to them in the strategies directory
+HELPERS_PACKAGE = "strategy_helpers"
+# Configuration a strategy's indicators can depend on, the rest (paths, wallet, ...) is per job
+INDICATOR_CONFIG_KEYS = ["timeframe", "stake_currency", "trading_mode", "margin_mode", "candle_type_def"]
+
+
+def source_hash(source_file: str) -> str:
+    """
+    Hash of a strategy file and of the shared helpers next to it, a change to
+    either one invalidates the strategy's cached indicators.
+    """
+    digest = hashlib.sha256()
+    helpers_dir = os.path.join(os.path.dirname(source_file), HELPERS_PACKAGE)
+    helpers = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(helpers_dir)
+        for file in files if file.endswith(".py")
+    )
+    for path in [source_file, *helpers]:
+        digest.update(os.path.relpath(path, os.path.dirname(source_file)).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def strategy_hash(strategy, source_file: str) -> str:
+    """
+    Everything but the pair's own candles the strategy's indicators depend on:
+    its source and helpers, its parameter values (defaults or the parameter
+    JSON file) and the configuration they can read.
+    """
+    parameters = {name: parameter.value for name, parameter in strategy.enumerate_parameters()}
+    config = getattr(strategy, "config", {}) or {}
+    settings = {key: config.get(key) for key in INDICATOR_CONFIG_KEYS}
+    settings["exchange"] = config.get("exchange", {}).get("name")
+    return _digest([source_hash(source_file), parameters, settings])
+
+
+def informative_hash(strategy) -> str:
+    # Range of every informative dataframe the strategy reads through the DataProvider
+    ranges = []
+    for pair, timeframe, *candle_type in sorted(strategy.gather_informative_pairs(), key=str):
+        informative = strategy.dp.get_pair_dataframe(pair, timeframe, *candle_type)
+        if informative is None or informative.empty:
+            ranges.append([pair, timeframe, 0])
+        else:
+            ranges.append([pair, timeframe, len(informative), informative["date"].iloc[0], informative["date"].iloc[-1]])
+    return _digest(ranges)
+
+
+class IndicatorCache:
+    """
+    On-disk cache of `advise_indicators` output, one parquet file per
+    (strategy hash, informative data, pair, timeframe, candle range).
+    With `prefix_reuse` the last candle is left out of the key and an entry
+    serves any job starting at the same candle and ending at or before the
+    cached one, which assumes strategies never look ahead. Least recently used
+    entries are evicted once the cache grows over `max_bytes`, checked at most
+    every `evict_interval` seconds.
+    """
+
+    def __init__(self, root: str = INDICATOR_CACHE_DIR, max_bytes: int = INDICATOR_CACHE_SIZE_MB * 1024 * 1024,
+                 evict_interval: float = INDICATOR_CACHE_EVICT_SECONDS, prefix_reuse: bool = INDICATOR_CACHE_PREFIX_REUSE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self.prefix_reuse = prefix_reuse
+        self.last_evicted = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, strategy_hash: str, informative_hash: str, pair: str, timeframe: str, dataframe) -> str:
+        candles = [dataframe["date"].iloc[0].isoformat()]
+        if not self.prefix_reuse:
+            candles += [dataframe["date"].iloc[-1].isoformat(), len(dataframe)]
+        return _digest([strategy_hash, informative_hash, pair, timeframe, candles])
+
+    def get(self, key: str, dataframe):
+        import pandas as pd
+        path = os.path.join(self.root, f"{key}.parquet")
+        try:
+            cached = pd.read_parquet(path)
+        except FileNotFoundError:
+            # Not cached yet, or evicted by another worker
+            cached = None
+        if cached is not None:
+            cached = cached[cached["date"] <= dataframe["date"].iloc[-1]].reset_index(drop=True)
+            # Same candles in, otherwise the store changed since (e.g. a filled gap)
+            if len(cached) == len(dataframe) and cached["date"].iloc[-1] == dataframe["date"].iloc[-1]:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+                self.hits += 1
+                return cached
+        self.misses += 1
+        return None
+
+    def put(self, key: str, dataframe):
+        path = os.path.join(self.root, f"{key}.parquet")
+        # Other workers read the cache meanwhile: write aside, then swap the file in
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=f".{key}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            dataframe.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            os.remove(tmp)
+            # Columns parquet can't hold (mixed objects), just don't cache this one
+            print(f"Failed to cache indicators {key}: {e}")
+            return
+        if time.monotonic() - self.last_evicted >= self.evict_interval:
+            self.evict()
+
+    def evict(self):
+        self.last_evicted = time.monotonic()
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".parquet"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            size -= entry_size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+        }
+
+    def attach(self, strategy):
+        """
+        Route the strategy's advise_indicators through the cache.
+        """
+        source_file = getattr(strategy, "__file__", None) or inspect.getfile(type(strategy))
+        advise_indicators = strategy.advise_indicators
+        # Computed on the first call, once parameters and data are loaded
+        hashes = []
+
+        def cached_advise_indicators(dataframe, metadata):
+            if dataframe.empty:
+                return advise_indicators(dataframe, metadata)
+            if not hashes:
+                hashes.extend([strategy_hash(strategy, source_file), informative_hash(strategy)])
+            key = self.key(*hashes, metadata.get("pair"), strategy.timeframe, dataframe)
+            cached = self.get(key, dataframe)
+            if cached is not None:
+                return cached
+            dataframe = advise_indicators(dataframe, metadata)
+            self.put(key, dataframe)
+            return dataframe
+
+        strategy.advise_indicators = cached_advise_indicators
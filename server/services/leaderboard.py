@@ -0,0 +1,122 @@
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.database import Database
+
+ROLLUP_COLLECTION = "strategy_rollups"
+
+# Ranking metrics, averaged over the backtests of a strategy, and their best order
+METRICS = {
+    "profit": DESCENDING,
+    "profit_percentage": DESCENDING,
+    "win_rate": DESCENDING,
+    "max_drawdown": ASCENDING,
+    "profit_factor": DESCENDING,
+    "trade_per_day": DESCENDING,
+}
+COUNTS = ["total_trades", "wins", "losses"]
+
+
+def rollup_performances(db: Database, backtesting: dict, performances: list[dict]):
+    """
+    Fold the performances of a completed backtesting into the running sums of
+    their (strategy, timeframe, pair group) rollup, so the leaderboard never
+    has to read the performance rows themselves.
+    """
+    now = datetime.now(timezone.utc)
+    operations = []
+    for performance in performances:
+        key = {
+            "strategy_id": ObjectId(performance["strategy_id"]) if performance.get("strategy_id") else None,
+            "timeframe": backtesting.get("timeframe", "5m"),
+            "pair_group_id": backtesting.get("pair_group_id"),
+        }
+        operations.append(UpdateOne({"_id": key}, {
+            "$set": {**key, "strategy_name": performance.get("strategy_name", ""), "updated_at": now},
+            "$inc": {
+                "backtests": 1,
+                **{f"sum_{metric}": performance.get(metric) or 0 for metric in METRICS},
+                **{count: performance.get(count) or 0 for count in COUNTS},
+            },
+            "$max": {"worst_drawdown": performance.get("max_drawdown") or 0},
+        }, upsert=True))
+    if operations:
+        db.get_collection(ROLLUP_COLLECTION).bulk_write(operations, ordered=False)
+
+
+def rollup_group_stage() -> dict:
+    return {"$group": {
+        "_id": "$strategy_id",
+        "strategy_name": {"$last": "$strategy_name"},
+        "backtests": {"$sum": "$backtests"},
+        **{f"sum_{metric}": {"$sum": f"$sum_{metric}"} for metric in METRICS},
+        **{count: {"$sum": f"${count}"} for count in COUNTS},
+        "worst_drawdown": {"$max": "$worst_drawdown"},
+    }}
+
+
+def performance_group_stage() -> dict:
+    # Same shape as rollup_group_stage, straight from strategy_performances
+    return {"$group": {
+        "_id": "$strategy_id",
+        "strategy_name": {"$last": "$strategy_name"},
+        "backtests": {"$sum": 1},
+        **{f"sum_{metric}": {"$sum": f"${metric}"} for metric in METRICS},
+        **{count: {"$sum": f"${count}"} for count in COUNTS},
+        "worst_drawdown": {"$max": "$max_drawdown"},
+    }}
+
+
+def rollup_match(timeframes: list[str] = None, pair_group_ids: list[str] = None) -> dict:
+    match = {}
+    if timeframes:
+        match["timeframe"] = {"$in": timeframes}
+    if pair_group_ids:
+        match["pair_group_id"] = {"$in": [ObjectId(pair_group_id) for pair_group_id in pair_group_ids]}
+    return match
+
+
+def ranking_stages(sort: str = "profit", limit: int = 50) -> list[dict]:
+    return [
+        {"$project": {
+            "strategy_name": 1,
+            "backtests": 1,
+            "worst_drawdown": 1,
+            **{count: 1 for count in COUNTS},
+            **{metric: {"$divide": [f"$sum_{metric}", "$backtests"]} for metric in METRICS},
+        }},
+        {"$sort": {sort: METRICS[sort], "_id": ASCENDING}},
+        {"$limit": limit},
+    ]
+
+
+def leaderboard_row(r: dict, rank: int) -> dict:
+    return {
+        "rank": rank,
+        "strategy_id": str(r["_id"]) if r.get("_id") else "",
+        "strategy_name": r.get("strategy_name", ""),
+        "backtests": r["backtests"],
+        **{metric: r.get(metric, 0) for metric in METRICS},
+        **{count: r.get(count, 0) for count in COUNTS},
+        "worst_drawdown": r.get("worst_drawdown", 0),
+    }
+
+
+def rebuild_rollups(db: Database):
+    # Recompute every rollup from the completed backtestings, e.g. for data
+    # stored before the rollups existed
+    db.get_collection(ROLLUP_COLLECTION).delete_many({})
+    backtestings = db.get_collection("backtestings").find(
+        {"status": "completed"}, {"timeframe": 1, "pair_group_id": 1, "performances": 1}
+    )
+    for backtesting in backtestings:
+        performances = list(db.get_collection("strategy_performances").find({"_id": {"$in": backtesting.get("performances", [])}}))
+        rollup_performances(db, backtesting, performances)
+
+
+if __name__ == "__main__":
+    # cd server && python -m services.leaderboard
+    from db import get_db
+    rebuild_rollups(get_db())
+    print("Rollups rebuilt")
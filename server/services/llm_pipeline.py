@@ -0,0 +1,192 @@
+import ast
+import asyncio
+import hashlib
+import os
+import random
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from pymongo.collection import Collection
+
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 4))
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", 50))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 6))
+CHECKPOINT_COLLECTION = "analysis_checkpoints"
+ANALYSIS_CACHE_COLLECTION = "strategy_analyses"
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    # openai.RateLimitError, anthropic.RateLimitError / OverloadedError or any HTTP 429 / 529
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    name = type(e).__name__
+    return status in (429, 529) or "RateLimit" in name or "Overloaded" in name
+
+
+def model_name(llm) -> str:
+    # ChatOpenAI exposes model_name, ChatAnthropic model
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def normalize_source(code: str) -> str:
+    # The AST ignores comments, blank lines and formatting, so reformatting a
+    # strategy does not count as a change
+    try:
+        return ast.dump(ast.parse(code))
+    except SyntaxError:
+        return "\n".join(line.strip() for line in code.splitlines() if line.strip())
+
+
+class AnalysisCache:
+    """
+    Analyses already paid for, keyed by the normalised strategy source, the
+    prompt version and the model. Bump the prompt version whenever the prompt
+    or the expected response changes.
+    """
+
+    def __init__(self, collection: Collection, prompt_version: str, model: str):
+        self.collection = collection
+        self.prompt_version = prompt_version
+        self.model = model
+
+    def key(self, code: str) -> str:
+        source = f"{self.prompt_version}\0{self.model}\0{normalize_source(code)}"
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def get(self, code: str) -> dict | None:
+        res = self.collection.find_one({"_id": self.key(code)}, {"result": 1})
+        return res["result"] if res else None
+
+    def put(self, code: str, result: dict):
+        # The fallback returned once all retries failed has no analysis, never keep it
+        if not result.get("Analyze"):
+            return
+        self.collection.update_one({"_id": self.key(code)}, {"$set": {
+            "prompt_version": self.prompt_version,
+            "model": self.model,
+            "result": result,
+            "created_at": datetime.now(timezone.utc),
+        }}, upsert=True)
+
+
+def _digest(item) -> str:
+    return hashlib.sha256(str(item).encode()).hexdigest()
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, in bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AnalysisPipeline:
+    """
+    Runs a blocking LLM analysis over many items within the provider quota: at
+    most `concurrency` calls in flight, `requests_per_minute` on average and
+    exponential backoff when the provider answers with a rate limit error.
+    Every finished item is checkpointed under `run_id` with a digest of its
+    content, starting the same run again after an interruption only analyses
+    what is left or changed since. The checkpoints of a run are cleared once
+    it finished without failures. With a `cache`, items are source codes and
+    unchanged ones reuse their previous analysis.
+    """
+
+    def __init__(self, analyze: Callable[[str], object], checkpoints: Collection, run_id: str, cache: AnalysisCache = None,
+                 concurrency: int = LLM_CONCURRENCY, requests_per_minute: float = LLM_REQUESTS_PER_MINUTE, max_retries: int = LLM_MAX_RETRIES):
+        self.analyze = analyze
+        self.checkpoints = checkpoints
+        self.run_id = run_id
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(requests_per_minute / 60, max(1, concurrency))
+        self.max_retries = max_retries
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.reused = 0
+
+    def _checkpoint(self, key: str, item, status: str, error: str = None):
+        self.checkpoints.update_one(
+            {"run_id": self.run_id, "key": key},
+            {"$set": {"status": status, "digest": _digest(item), "error": error, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    async def _call(self, key: str, item):
+        for attempt in range(self.max_retries):
+            await self.bucket.acquire()
+            try:
+                return await asyncio.to_thread(self.analyze, item)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries - 1:
+                    raise
+                delay = min(60, 2 ** attempt) + random.random()
+                print(f"Rate limited on {key}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _analyze(self, key: str, item):
+        if self.cache is None:
+            return await self._call(key, item)
+        result = await asyncio.to_thread(self.cache.get, item)
+        if result is not None:
+            self.reused += 1
+            return result
+        result = await self._call(key, item)
+        await asyncio.to_thread(self.cache.put, item, result)
+        return result
+
+    async def _process(self, key: str, item, on_result: Callable[[str, object], None]):
+        async with self.semaphore:
+            try:
+                result = await self._analyze(key, item)
+                await asyncio.to_thread(on_result, key, result)
+            except Exception as e:
+                self.failed += 1
+                print(f"Failed to analyze {key}: {e}")
+                await asyncio.to_thread(self._checkpoint, key, item, "failed", str(e))
+                return
+            await asyncio.to_thread(self._checkpoint, key, item, "done")
+            self.done += 1
+            print(f"[{self.done + self.failed}/{self.total}] {key}")
+
+    async def run(self, items: dict[str, object], on_result: Callable[[str, object], None]) -> dict:
+        """
+        Analyse every item not finished yet in this run. `on_result(key, result)`
+        stores a result, an item only counts as finished once it returned.
+        """
+        finished = {
+            checkpoint["key"]: checkpoint.get("digest") for checkpoint in
+            self.checkpoints.find({"run_id": self.run_id, "status": "done"}, {"key": 1, "digest": 1})
+        }
+        pending = {key: item for key, item in items.items() if finished.get(key) != _digest(item)}
+        self.total = len(pending)
+        print(f"Run {self.run_id}: {len(items) - len(pending)} already analyzed, {len(pending)} to go")
+        await asyncio.gather(*(self._process(key, item, on_result) for key, item in pending.items()))
+        if not self.failed:
+            # Complete, the next run with this id starts over
+            await asyncio.to_thread(self.checkpoints.delete_many, {"run_id": self.run_id})
+        return {
+            "run_id": self.run_id,
+            "resumed": len(items) - len(pending),
+            "done": self.done,
+            "reused": self.reused,
+            "failed": self.failed,
+        }
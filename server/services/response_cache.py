@@ -0,0 +1,81 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Hashable
+
+AI_QUERY_CACHE_SIZE = int(os.environ.get("AI_QUERY_CACHE_SIZE", 256))
+AI_QUERY_CACHE_TTL = float(os.environ.get("AI_QUERY_CACHE_TTL", 3600))
+
+
+class ResponseCache:
+    """
+    LRU cache of LLM responses whose entries expire after `ttl` seconds.
+    Identical requests arriving while the first one is still running wait for
+    its response instead of calling the model again. Lives in the event loop
+    of one API process.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, tuple[float, str]] = OrderedDict()
+        self.in_flight: dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable) -> str | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: str):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def stream(self, key: Hashable, chunks: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Yield the response of `key` chunk by chunk. Cached and coalesced
+        responses come as one chunk, only the first request streams from the model.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            yield cached
+            return
+        pending = self.in_flight.get(key)
+        if pending is not None:
+            # shield: a client going away must not cancel the shared response
+            yield await asyncio.shield(pending)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        parts = []
+        try:
+            async for chunk in chunks():
+                parts.append(chunk)
+                yield chunk
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Response aborted"))
+            # Retrieved here, requests waiting on it still get the error
+            future.exception()
+            raise
+        else:
+            value = "".join(parts)
+            self.set(key, value)
+            future.set_result(value)
+        finally:
+            del self.in_flight[key]
+
+    async def get_or_create(self, key: Hashable, create: Callable[[], Awaitable[str]]) -> str:
+        async def chunks():
+            yield await create()
+        return "".join([chunk async for chunk in self.stream(key, chunks)])
+
+
+ai_query_cache = ResponseCache(AI_QUERY_CACHE_SIZE, AI_QUERY_CACHE_TTL)
@@ -1,5 +1,8 @@
+import hashlib
 from textwrap import dedent
+from pymongo import ASCENDING, DESCENDING
 from pymongo.database import Database
+from pymongo import ReturnDocument
 from bson.objectid import ObjectId
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import SystemMessage
@@ -8,11 +11,41 @@ from pydantic import BaseModel, Field
 from langchain_core.prompts import PromptTemplate
 from langchain.chains.llm import LLMChain
 from dateutil import parser
+from services.llm_pipeline import is_rate_limit_error
 
 
-def get_backtestings(db: Database):
-    res = db.get_collection("backtestings").find()
-    return [{
+def _keyset_query(query: dict, sort: str = "id", anchor: dict = None):
+    """
+    Keyset pagination: `anchor` is the last document of the previous page
+    and the next page starts right after it in `sort` order ("-" for
+    descending), `_id` breaking ties. Pages cost the same wherever they are.
+    Returns the query and the sort order to run it with.
+    """
+    direction = DESCENDING if sort.startswith("-") else ASCENDING
+    field = _sort_field(sort)
+    op = "$gt" if direction == ASCENDING else "$lt"
+    query = dict(query)
+    if anchor:
+        if field == "_id" or field not in anchor:
+            query["_id"] = {op: anchor["_id"]}
+        else:
+            query["$or"] = [
+                {field: {op: anchor[field]}},
+                {field: anchor[field], "_id": {op: anchor["_id"]}},
+            ]
+    order = [("_id", direction)] if field == "_id" else [(field, direction), ("_id", direction)]
+    return query, order
+
+def _sort_field(sort: str):
+    field = sort.lstrip("-")
+    return "_id" if field == "id" else field
+
+BACKTESTING_SUMMARY_FIELDS = {
+    "name": 1, "status": 1, "start_date": 1, "end_date": 1, "pair_group_id": 1, "timeframe": 1, "strategy_id": 1,
+}
+
+def _backtesting_summary(r: dict):
+    return {
         "id": str(r["_id"]),
         "name": r.get("name", ""),
         "status": r.get("status", "pending"),
@@ -21,7 +54,7 @@ def get_backtestings(db: Database):
         "pair_group_id": str(r.get("pair_group_id", "")),
         "timeframe": r.get("timeframe", "5m"),
         "strategy_id": str(r.get("strategy_id", "")),
-    } for r in list(res)]
+    }
 
 def get_backtesting(db: Database, id: str):
     res = db.get_collection("backtestings").find_one({"_id": ObjectId(id)})
@@ -60,13 +93,28 @@ def get_backtesting_to_process(db: Database, id: str):
                 "foreignField": "_id",
                 "as": "strategy"
             }
+        },
+        # Batches list all their strategies, as ids or their string form
+        {
+            "$addFields": {
+                "strategy_ids": {"$map": {"input": {"$ifNull": ["$strategies", []]}, "in": {"$toObjectId": "$$this"}}}
+            }
+        },
+        {
+            "$lookup": {
+                "from": "strategies",
+                "localField": "strategy_ids",
+                "foreignField": "_id",
+                "as": "batch_strategies"
+            }
         }
     ]
     res = list(db.get_collection("backtestings").aggregate(pipeline=pipeline))
     if not res:
         return None
     res = res[0]
-    strategy = res.get('strategy', [{}])[0] if res.get('strategy') else {}
+    # Every strategy of the backtesting, each one shards the backtest stage
+    strategies = {str(strategy["_id"]): strategy for strategy in [*res.get('strategy', []), *res.get('batch_strategies', [])]}
     db.get_collection("backtestings").update_one({
         "_id": ObjectId(id)
     }, {
@@ -81,39 +129,43 @@ def get_backtesting_to_process(db: Database, id: str):
         "timeframe": res.get("timeframe", "5m"),
         "pairs": res.get('pair_group', [{}])[0].get('pairs', []),
         "strategies": [{
-            "_id": str(strategy.get("_id", "")),
+            "_id": strategy_id,
             "name": strategy.get("name", ""),
-        }] if strategy.get("_id") else [],
+        } for strategy_id, strategy in strategies.items()],
     }
 
-def create_backtesting(db: Database, backtesting: dict):
-    res = db.get_collection("backtestings").insert_one({
+def _new_backtesting(backtesting: dict):
+    return {
         "name": backtesting.get('name', ''),
         "status": "pending",
         "start_date": parser.parse(backtesting.get('start_date', '')).strftime('%Y-%m-%d'),
         "end_date": parser.parse(backtesting.get('end_date', '')).strftime('%Y-%m-%d'),
         "pair_group_id": ObjectId(backtesting.get('pair_group_id', '')),
         "strategy_id": ObjectId(backtesting.get('strategy_id', '')),
+        "strategies": [ObjectId(strategy_id) for strategy_id in backtesting.get('strategy_ids', [])],
         "timeframe": backtesting.get('timeframe', '5m'),
         "performances": [],
-    })
-    return str(res.inserted_id)
+    }
 
-def complete_backtesting(db: Database, id: str, performances: list[str]):
-    res = db.get_collection("backtestings").update_one({
+def complete_backtesting(db: Database, id: str, performances: list[str], timings: list[dict] = None):
+    from services.leaderboard import rollup_performances
+    performance_ids = [ObjectId(performance_id) for performance_id in performances]
+    previous = db.get_collection("backtestings").find_one_and_update({
         "_id": ObjectId(id)
     }, {
         "$set": {
             "status": "completed",
-            "performances": [ObjectId(performance_id) for performance_id in performances]
+            "performances": performance_ids,
+            "timings": timings or [],
         }
-    })
-    return str(res.modified_count)
+    }, projection={"status": 1, "timeframe": 1, "pair_group_id": 1}, return_document=ReturnDocument.BEFORE)
+    # Count each backtesting once in the leaderboard, even if a task is retried
+    if previous and previous.get("status") != "completed":
+        rollup_performances(db, previous, list(db.get_collection("strategy_performances").find({"_id": {"$in": performance_ids}})))
+    return "1" if previous else "0"
 
-def get_backtesting_performance(db: Database, id: str):
-    res = db.get_collection("backtestings").find_one({"_id": ObjectId(id)})
-    res = db.get_collection("strategy_performances").find({"_id": {"$in": res["performances"]}})
-    return [{
+def _performance(r: dict):
+    return {
         "id": str(r["_id"]),
         "strategy_id": str(r["strategy_id"]),
         "strategy_name": r["strategy_name"],
@@ -128,9 +180,64 @@ def get_backtesting_performance(db: Database, id: str):
         "final_balance": r["final_balance"],
         "max_drawdown": r["max_drawdown"],
         "profit_percentage": r["profit_percentage"],
-    } for r in list(res)]
+        "profit_factor": r.get("profit_factor", 0),
+    }
+
+def _trade_filter(id: str, strategy_name: str = None, pair: str = None, start_date: str = None, end_date: str = None):
+    match = {"backtesting_id": ObjectId(id)}
+    if strategy_name:
+        match["strategy_name"] = strategy_name
+    if pair:
+        match["pair"] = pair
+    if start_date or end_date:
+        match["open_date"] = {}
+        if start_date:
+            match["open_date"]["$gte"] = parser.isoparse(start_date)
+        if end_date:
+            match["open_date"]["$lt"] = parser.isoparse(end_date)
+    return match
+
+def _trade(r: dict):
+    return {
+        **r,
+        "strategy_id": str(r["strategy_id"]) if r.get("strategy_id") else "",
+    }
+
+def _trade_stats_pipeline(match: dict, group_by: str):
+    # Aggregated by MongoDB, only one row per group comes back
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": f"${group_by}",
+            "total_trades": {"$sum": 1},
+            "wins": {"$sum": {"$cond": [{"$gt": ["$profit_abs", 0]}, 1, 0]}},
+            "losses": {"$sum": {"$cond": [{"$lt": ["$profit_abs", 0]}, 1, 0]}},
+            "profit_abs": {"$sum": "$profit_abs"},
+            "avg_profit_ratio": {"$avg": "$profit_ratio"},
+            "avg_trade_duration": {"$avg": "$trade_duration"},
+            "first_open_date": {"$min": "$open_date"},
+            "last_close_date": {"$max": "$close_date"},
+        }},
+        {"$sort": {"profit_abs": -1}},
+    ]
+
+def _trade_stats(r: dict, group_by: str):
+    return {
+        group_by: r["_id"],
+        "total_trades": r["total_trades"],
+        "wins": r["wins"],
+        "losses": r["losses"],
+        "win_rate": r["wins"] / r["total_trades"] if r["total_trades"] else 0,
+        "profit_abs": r["profit_abs"],
+        "avg_profit_ratio": r["avg_profit_ratio"],
+        "avg_trade_duration": r["avg_trade_duration"],
+        "first_open_date": r["first_open_date"],
+        "last_close_date": r["last_close_date"],
+    }
 
 def add_backtesting_performances(db: Database, performances: list[dict]):
+    if not performances:
+        return []
     res = db.get_collection("strategy_performances").insert_many([{
         "strategy_id": ObjectId(performance.get("strategy_id", "")),
         "strategy_name": performance.get("strategy_name", ""),
@@ -150,91 +257,43 @@ def add_backtesting_performances(db: Database, performances: list[dict]):
         "profit_percentage": performance.get("profit_percentage", 0),
         "avg_profit_percentage": performance.get("avg_profit_percentage", 0),
         "win_rate": performance.get("win_rate", 0),
-    } for performance in performances])
+        "profit_factor": performance.get("profit_factor", 0),
+    } for performance in performances], ordered=False)
     return list(res.inserted_ids)
 
 
-def get_pairs(db: Database):
-    res = db.get_collection("pairs").find()
-    return [{
+PAIR_FIELDS = {"name": 1, "description": 1}
+
+def _pair(r: dict):
+    return {
         "id": str(r["_id"]),
         "name": r["name"],
         "description": r["description"],
-    } for r in list(res)]
+    }
 
-def get_pair_groups(db: Database):
-    res = db.get_collection("pair_groups").find()
-    return [{
+def _pair_group(r: dict):
+    return {
         "id": str(r["_id"]),
         "name": r["name"],
         "pairs": r["pairs"],
         "description": r["description"]
-    } for r in list(res)]
+    }
 
-def get_strategy_groups(db: Database):
-    res = db.get_collection("strategy_groups").find()
-    return [{
+def _strategy_group(r: dict):
+    return {
         "id": str(r["_id"]),
         "name": r["name"],
         "strategies": r["strategies"],
         "description": r["description"]
-    } for r in list(res)]
-
-def get_strategy_group(db: Database, id: str):
-    res = db.get_collection("strategy_groups").find_one({"_id": ObjectId(id)})
-    return {
-        "id": str(res["_id"]),
-        "name": res["name"],
-        "strategies": res["strategies"],
-        "description": res["description"],
     }
 
-def create_strategy_group(db: Database, strategy_group: dict):
-    res = db.get_collection("strategy_groups").insert_one({
-        "name": strategy_group.get('name', ''),
-        "strategies": strategy_group.get('strategies', []),
-        "description": strategy_group.get('description', ''),
-    })
+def _strategy_group_document(strategy_group: dict):
     return {
-        "id": str(res.inserted_id),
         "name": strategy_group.get('name', ''),
         "strategies": strategy_group.get('strategies', []),
         "description": strategy_group.get('description', ''),
     }
 
-def update_strategy_group(db: Database, id: str, strategy_group: dict):
-    res = db.get_collection("strategy_groups").update_one({
-        '_id': ObjectId(id)
-    }, {
-        '$set': {
-            'name': strategy_group.get('name', ''),
-            'strategies': strategy_group.get('strategies', []),
-            'description': strategy_group.get('description', ''),
-        }
-    }, upsert=True)
-    return str(res.upserted_id)
-
-def delete_strategy_group(db: Database, id: str):
-    res = db.get_collection("strategy_groups").delete_one({"_id": ObjectId(id)})
-    return str(res.deleted_count)
-
-def create_pair_group(db: Database, pair_group):
-    res = db.get_collection("pair_groups").insert_one({
-        "name": pair_group.name,
-        "pairs": pair_group.pairs,
-        "description": pair_group.description,
-    })
-    return {
-        "id": str(res.inserted_id),
-        "name": pair_group.name,
-        "pairs": pair_group.pairs,
-        "description": pair_group.description,
-    }
-
-def delete_pair_group(db: Database, id: str):
-    res = db.get_collection("pair_groups").delete_one({"_id": ObjectId(id)})
-    return str(res.deleted_count)
-
 def add_pair(db: Database, pair: dict):
     res = db.get_collection("pairs").update_one({
         'name': pair['name']
@@ -246,24 +305,26 @@ def add_pair(db: Database, pair: dict):
     return str(res.upserted_id)
 
 
-def get_strategies(db: Database):
-    res = db.get_collection("strategies").find()
-    return [{
+# code and analysis are only needed on the strategy page, never in the list
+STRATEGY_SUMMARY_FIELDS = {"name": 1, "description": 1, "indicators": 1}
+STRATEGY_FIELDS = {"name": 1, "description": 1, "indicators": 1, "example": 1, "explanation": 1}
+
+def _strategy_summary(r: dict):
+    return {
         "id": str(r["_id"]),
         "name": r["name"],
         "description": r["description"],
         "indicators": r.get("indicators", []),
-    } for r in list(res)]
+    }
 
-def get_strategy(db: Database, id: str):
-    res = db.get_collection("strategies").find_one({"_id": ObjectId(id)})
+def _strategy(r: dict):
     return {
-        "id": str(res["_id"]),
-        "name": res["name"],
-        "description": res["description"],
-        "indicators": res.get("indicators", []),
-        "example": res.get("example", ""),
-        "explanation": res.get("explanation", "")
+        "id": str(r["_id"]),
+        "name": r["name"],
+        "description": r["description"],
+        "indicators": r.get("indicators", []),
+        "example": r.get("example", ""),
+        "explanation": r.get("explanation", "")
     }
 
 def add_strategy(db: Database, strategy: dict):
@@ -279,28 +340,19 @@ def add_strategy(db: Database, strategy: dict):
     }, upsert=True)
     return str(res.upserted_id)
 
-def save_strategy(db: Database, id: str, strategy: dict):
-    res = db.get_collection("strategies").update_one({
-        '_id': ObjectId(id)
-    }, {
-        '$set': {
-            'description': strategy.get('description', ''),
-            'indicators': strategy.get('indicators', []),
-            'example': strategy.get('example', ''),
-            'explanation': strategy.get('explanation', ''),
-        }
-    }, upsert=True)
-    return str(res.upserted_id)
+def delete_strategies(db: Database, names: list[str]):
+    res = db.get_collection("strategies").delete_many({"name": {"$in": names}})
+    return str(res.deleted_count)
 
-def query_ai(db: Database, llm: BaseChatModel, strategy_id, query: str, query_type: str, content: str = None):
-    res = db.get_collection("strategies").find_one({"_id": ObjectId(strategy_id)})
-    if content:
-        data = content
-    else:
-        data = res.get(query_type, "")
+def _strategy_update(strategy: dict):
+    return {
+        'description': strategy.get('description', ''),
+        'indicators': strategy.get('indicators', []),
+        'example': strategy.get('example', ''),
+        'explanation': strategy.get('explanation', ''),
+    }
 
-    code = res.get("code", "")
-    print(data)
+def _ai_query_messages(code: str, query_type: str, data: str, query: str):
     system = SystemMessage(dedent("""You are a FreqTrade expertise and can analyze, improve the content based on strategy code and user requirements. 
         Return only the improved content, without modifying code or have any notation or notification text. MUST return as markdown format without Heading 1."""))
     template = f"""
@@ -315,33 +367,46 @@ def query_ai(db: Database, llm: BaseChatModel, strategy_id, query: str, query_ty
         {query}
         ==== END USER REQUIREMENT ====
     """
-    res = llm.invoke([system, template])
-    return res.content
+    return [system, template]
+
+def _ai_query_key(strategy_id: str, code: str, query_type: str, query: str, data: str, model: str):
+    # Editing the code or the content of the strategy gives a new key
+    def digest(text):
+        return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+    return (strategy_id, digest(code), query_type, query, digest(data), model)
+
+# Part of the analysis cache key, bump it whenever the prompt or StrategyResponse changes
+STRATEGY_PROMPT_VERSION = "strategy-analysis-v1"
+
+class StrategyResponse(BaseModel):
+    Status: str = Field(..., description="Status of the strategy logic code verification. CORRECT or INCORRECT.")
+    Analyze: str = Field(..., description="Detailed analysis of the strategy.")
+    Indicators: list[str] = Field(..., description="List of the indicators used in the strategy.")
+    Explanation: str = Field(..., description="Detailed explanation of the strategy logic.")
+    Example: str = Field(..., description="A very detailed example for the strategy logic.")
+    Recommendation: str = Field(..., description="Recommendation list of the strategy improvement or Fixes if it is incorrect.")
+    CodeReview: str = Field(..., description="Code review of the strategy code, and suggestions for improvement.")
+
+strategy_parser = PydanticOutputParser(pydantic_object=StrategyResponse)
+strategy_prompt = PromptTemplate(template=dedent("""You are a FreqTrade expertise and can verify strategies code. You will receive a strategy code and you need to verify it. Analyze the strategy, understand the logic, and provide feedback.           
+    ==== STRATEGY CODE ====
+    {strategy}
+    ==== END STRATEGY CODE ====
+    {format_instructions}
+    """), input_variables=["strategy"], partial_variables={'format_instructions': strategy_parser.get_format_instructions()})
 
 def process_strategy(llm: BaseChatModel, strategy: str, max_retries=3):
+    chain = LLMChain(llm=llm, prompt=strategy_prompt, output_parser=strategy_parser)
     while max_retries > 0:
-        class StrategyResponse(BaseModel):
-            Status: str = Field(..., description="Status of the strategy logic code verification. CORRECT or INCORRECT.")
-            Analyze: str = Field(..., description="Detailed analysis of the strategy.")
-            Indicators: list[str] = Field(..., description="List of the indicators used in the strategy.")
-            Explanation: str = Field(..., description="Detailed explanation of the strategy logic.")
-            Example: str = Field(..., description="A very detailed example for the strategy logic.")
-            Recommendation: str = Field(..., description="Recommendation list of the strategy improvement or Fixes if it is incorrect.")
-            CodeReview: str = Field(..., description="Code review of the strategy code, and suggestions for improvement.")
-        pydantic_parser = PydanticOutputParser(pydantic_object=StrategyResponse)
-        prompt = PromptTemplate(template=dedent("""You are a FreqTrade expertise and can verify strategies code. You will receive a strategy code and you need to verify it. Analyze the strategy, understand the logic, and provide feedback.           
-        ==== STRATEGY CODE ====
-        {strategy}
-        ==== END STRATEGY CODE ====
-        {format_instructions}
-        """), input_variables=["strategy"], partial_variables={'format_instructions': pydantic_parser.get_format_instructions()})
-        chain = LLMChain(llm=llm, prompt=prompt, output_parser=pydantic_parser)
         try:
             result = chain.invoke(input={
                 "strategy": strategy
             })
             return result.get('text', '')
         except Exception as e:
+            # Quota errors are retried with backoff by the caller
+            if is_rate_limit_error(e):
+                raise
             print(e)
             max_retries -= 1
     return StrategyResponse(Status="INCORRECT", Analyze="", Indicators=[], Explanation="", Example="", Recommendation="", CodeReview="")
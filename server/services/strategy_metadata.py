@@ -0,0 +1,275 @@
+import ast
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+# Modules whose functions are indicators, as imported by strategies
+INDICATOR_MODULES = {
+    "talib",
+    "talib.abstract",
+    "pandas_ta",
+    "technical.indicators",
+    "technical.qtpylib",
+    "freqtrade.vendor.qtpylib.indicators",
+}
+# Literal class attributes kept with the metadata
+CLASS_ATTRIBUTES = ["timeframe", "startup_candle_count", "stoploss", "can_short", "minimal_roi"]
+# Informative timeframe given as self.timeframe, replaced by the timeframe the strategy runs on
+STRATEGY_TIMEFRAME = "{timeframe}"
+_UNKNOWN = object()
+
+
+@dataclass
+class StrategyMetadata:
+    filename: str
+    class_name: str = ""
+    # The class subclasses IStrategy, directly or through a class of the same file
+    is_strategy: bool = False
+    docstring: str = ""
+    indicators: list[str] = field(default_factory=list)
+    attributes: dict = field(default_factory=dict)
+    # (pair, timeframe) of the informative data, pair None for each traded pair,
+    # timeframe None when it cannot be resolved statically
+    informative: list[tuple[str | None, str | None]] = field(default_factory=list)
+    error: str = None
+
+
+def _dotted(node: ast.AST) -> list[str] | None:
+    # ta.abstract.RSI -> ["ta", "abstract", "RSI"]
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return parts[::-1]
+
+
+class _Scanner(ast.NodeVisitor):
+    """
+    Collects imports, attribute chains and classes in one walk, indicators are
+    resolved against the import aliases once the whole module was seen.
+    """
+
+    def __init__(self):
+        self.aliases = {}
+        self.functions = {}
+        self.chains = []
+        self.accessors = set()
+        self.classes = []
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            if alias.asname:
+                self.aliases[alias.asname] = alias.name
+            else:
+                # import talib.abstract binds talib
+                self.aliases[alias.name.split(".")[0]] = alias.name.split(".")[0]
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        for alias in node.names:
+            name = f"{node.module}.{alias.name}"
+            if name in INDICATOR_MODULES:
+                self.aliases[alias.asname or alias.name] = name
+            elif node.module in INDICATOR_MODULES:
+                self.functions[alias.asname or alias.name] = alias.name
+
+    def visit_Attribute(self, node: ast.Attribute):
+        chain = _dotted(node)
+        if chain:
+            self.chains.append(chain)
+            return
+        # dataframe.ta.rsi() of the pandas_ta accessor, on any expression
+        if isinstance(node.value, ast.Attribute) and node.value.attr == "ta":
+            self.accessors.add(node.attr)
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call):
+        if isinstance(node.func, ast.Name):
+            self.chains.append([node.func.id])
+        self.generic_visit(node)
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self.classes.append(node)
+        self.generic_visit(node)
+
+    def indicators(self) -> list[str]:
+        indicators = {accessor.upper() for accessor in self.accessors}
+        for chain in self.chains:
+            if len(chain) == 1:
+                if chain[0] in self.functions:
+                    indicators.add(self.functions[chain[0]].upper())
+                continue
+            module = self.aliases.get(chain[0])
+            if module is None:
+                if len(chain) == 3 and chain[1] == "ta":
+                    indicators.add(chain[2].upper())
+                continue
+            # Longest prefix naming an indicator module, its next attribute is the indicator
+            for end in range(len(chain) - 1, 0, -1):
+                if ".".join([module, *chain[1:end]]) in INDICATOR_MODULES:
+                    indicators.add(chain[end].upper())
+                    break
+        return sorted(indicators)
+
+
+def _base_names(node: ast.ClassDef) -> list[str]:
+    return [(_dotted(base) or [""])[-1] for base in node.bases]
+
+
+def _resolve(node: ast.AST, namespace: dict, local: dict = None):
+    """
+    Value of a literal expression, reading names, self.<attribute> and
+    subscripts of them (self.params["pivot_timeframe"]) from the class body
+    and the function `local` variables. _UNKNOWN when computed at runtime.
+    """
+    if isinstance(node, ast.Name):
+        if local and node.id in local:
+            return local[node.id]
+        return namespace.get(node.id, _UNKNOWN)
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in ("self", "cls"):
+        if node.attr == "timeframe":
+            # Overridden by --timeframe
+            return STRATEGY_TIMEFRAME
+        return namespace.get(node.attr, _UNKNOWN)
+    if isinstance(node, ast.Subscript):
+        value, key = _resolve(node.value, namespace, local), _resolve(node.slice, namespace, local)
+        try:
+            return _UNKNOWN if _UNKNOWN in (value, key) else value[key]
+        except (KeyError, IndexError, TypeError):
+            return _UNKNOWN
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        return _UNKNOWN
+
+
+def _assignments(statements) -> list[tuple[str, ast.AST]]:
+    assignments = []
+    for statement in statements:
+        if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+            target, value = statement.targets[0], statement.value
+        elif isinstance(statement, ast.AnnAssign) and statement.value is not None:
+            target, value = statement.target, statement.value
+        else:
+            continue
+        if isinstance(target, ast.Name):
+            assignments.append((target.id, value))
+    return assignments
+
+
+def _class_namespace(node: ast.ClassDef) -> dict:
+    # Literal values of the class body, in order, e.g. startup_candle_count = params["adx_period"]
+    namespace = {}
+    for name, value in _assignments(node.body):
+        value = _resolve(value, namespace)
+        if value is _UNKNOWN or value == STRATEGY_TIMEFRAME:
+            # Computed, e.g. a parameter or an expression
+            namespace.pop(name, None)
+        else:
+            namespace[name] = value
+    return namespace
+
+
+def _call_argument(node: ast.Call, position: int, keyword: str) -> ast.AST | None:
+    for argument in node.keywords:
+        if argument.arg == keyword:
+            return argument.value
+    return node.args[position] if len(node.args) > position else None
+
+
+def _informative(node: ast.ClassDef, namespace: dict) -> list[tuple[str | None, str | None]]:
+    """
+    Informative (pair, timeframe) of the @informative decorators, of the
+    tuples listed in informative_pairs() and of dp.get_pair_dataframe() calls.
+    """
+    informative = []
+
+    def add(pair_node: ast.AST | None, timeframe_node: ast.AST | None, local: dict):
+        pair = _resolve(pair_node, namespace, local) if pair_node is not None else _UNKNOWN
+        timeframe = _resolve(timeframe_node, namespace, local) if timeframe_node is not None else _UNKNOWN
+        # Templated assets ("{base}/USDT") and runtime pairs stand for the traded pairs
+        pair = pair if isinstance(pair, str) and "{" not in pair else None
+        timeframe = timeframe if isinstance(timeframe, str) else None
+        if (pair, timeframe) not in informative:
+            informative.append((pair, timeframe))
+
+    for function in node.body:
+        if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        local = {}
+        for name, value in _assignments(ast.walk(function)):
+            value = _resolve(value, namespace, local)
+            if value is not _UNKNOWN:
+                local[name] = value
+        for decorator in function.decorator_list:
+            if isinstance(decorator, ast.Call) and (_dotted(decorator.func) or [""])[-1] == "informative":
+                add(_call_argument(decorator, 1, "asset"), _call_argument(decorator, 0, "timeframe"), local)
+        for child in ast.walk(function):
+            if function.name == "informative_pairs" and isinstance(child, ast.Tuple) and len(child.elts) == 2:
+                add(child.elts[0], child.elts[1], local)
+            elif isinstance(child, ast.Call) and isinstance(child.func, ast.Attribute) and child.func.attr in ("get_pair_dataframe", "historic_ohlcv"):
+                add(_call_argument(child, 0, "pair"), _call_argument(child, 1, "timeframe"), local)
+    return informative
+
+
+def parse_strategy(source: str, filename: str = "") -> StrategyMetadata:
+    metadata = StrategyMetadata(filename=filename)
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        metadata.error = f"SyntaxError: {e}"
+        return metadata
+    scanner = _Scanner()
+    scanner.visit(tree)
+    metadata.indicators = scanner.indicators()
+
+    strategies = {"IStrategy"}
+    strategy_class = None
+    # Classes are visited in source order, a base is defined before its subclasses
+    for node in scanner.classes:
+        if strategies.intersection(_base_names(node)):
+            strategies.add(node.name)
+            strategy_class = node
+    if strategy_class is not None:
+        metadata.is_strategy = True
+    else:
+        # Subclass of a strategy imported from another file
+        strategy_class = next((node for node in scanner.classes if node.bases), scanner.classes[0] if scanner.classes else None)
+    if strategy_class is not None:
+        metadata.class_name = strategy_class.name
+        metadata.docstring = (ast.get_docstring(strategy_class) or "").strip()
+        namespace = _class_namespace(strategy_class)
+        metadata.attributes = {name: namespace[name] for name in CLASS_ATTRIBUTES if name in namespace}
+        metadata.informative = _informative(strategy_class, namespace)
+    return metadata
+
+
+def extract_metadata(file_path: str) -> StrategyMetadata:
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            source = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        return StrategyMetadata(filename=os.path.basename(file_path), error=str(e))
+    return parse_strategy(source, os.path.basename(file_path))
+
+
+def scan_strategies(file_paths: list[str], max_workers: int = None) -> list[StrategyMetadata]:
+    """
+    Metadata of every file, in order, parsed on a process pool. Files that
+    cannot be read or parsed come back with `error` set.
+    """
+    # Daemonic processes (celery prefork children) can't start a pool
+    if len(file_paths) < 2 or max_workers == 1 or multiprocessing.current_process().daemon:
+        return [extract_metadata(file_path) for file_path in file_paths]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(extract_metadata, file_paths, chunksize=max(1, len(file_paths) // ((max_workers or os.cpu_count() or 1) * 4))))
+
+
+if __name__ == "__main__":
+    # cd server && python -m services.strategy_metadata strategies/*.py
+    import sys
+    for metadata in scan_strategies(sys.argv[1:]):
+        print(f"{metadata.filename}: {metadata.class_name} strategy={metadata.is_strategy} {metadata.attributes} {metadata.informative} {metadata.indicators} {metadata.error or ''}")
@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from dateutil import parser
+from pymongo.database import Database
+
+TRADE_COLLECTION = "backtest_trades"
+
+# Trade fields kept from freqtrade's `--export trades`, the rest (orders,
+# funding fees, ...) is not queried and would only bloat the collection
+TRADE_FIELDS = [
+    "pair", "is_short", "leverage", "enter_tag", "exit_reason",
+    "open_rate", "close_rate", "amount", "stake_amount",
+    "profit_abs", "profit_ratio", "trade_duration", "min_rate", "max_rate",
+]
+
+
+def _trade_date(trade: dict, field: str):
+    timestamp = trade.get(f"{field}_timestamp")
+    if timestamp is not None:
+        return datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+    if trade.get(f"{field}_date"):
+        return parser.isoparse(trade[f"{field}_date"])
+    return None
+
+
+class TradeWriter:
+    """
+    Trade sink for `read_strategy_results`: buffers the trades of one
+    backtesting and bulk inserts them into the trade collection, so trades
+    never have to be held in memory all at once.
+    """
+
+    def __init__(self, db: Database, backtesting_id: str, strategy_ids: dict = None, batch_size: int = 5000):
+        self.collection = db.get_collection(TRADE_COLLECTION)
+        self.backtesting_id = ObjectId(backtesting_id)
+        self.strategy_ids = {name: ObjectId(sid) for name, sid in (strategy_ids or {}).items() if sid}
+        self.batch_size = batch_size
+        self.buffer = []
+        self.written = 0
+        # A retried analysis must not store the trades twice
+        self.collection.delete_many({"backtesting_id": self.backtesting_id})
+
+    def __call__(self, strategy: str, trade: dict):
+        document = {field: trade.get(field) for field in TRADE_FIELDS}
+        document.update({
+            "backtesting_id": self.backtesting_id,
+            "strategy_id": self.strategy_ids.get(strategy),
+            "strategy_name": strategy,
+            "open_date": _trade_date(trade, "open"),
+            "close_date": _trade_date(trade, "close"),
+        })
+        self.buffer.append(document)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.collection.insert_many(self.buffer, ordered=False)
+        self.written += len(self.buffer)
+        self.buffer = []
@@ -2,11 +2,12 @@ from freqtrade.strategy.interface import IStrategy
 from functools import reduce
 from pandas import DataFrame
 
-import freqtrade.vendor.qtpylib.indicators as qtpylib
 from freqtrade.strategy import DecimalParameter, CategoricalParameter
 
 from talib import abstract
 
+from strategy_helpers.conditions import NORMALIZED_SUFFIX, all_conditions, normalize
+
 # ###############################################################################
 # ###############################################################################
 # @Farhad#0318
@@ -138,6 +139,8 @@ class HyperStra_GSN_SMAOnly(IStrategy):
     # HyperSMA
 
     # normalizer_lenght = IntParameter(low=1, high=400, default=20, space='entry', optimize=True)
+    # Candles the normalized MAs are scaled against, None for all candles so far
+    normalizer_window = None
 
     # BUY
     buy_1_indicator = CategoricalParameter(
@@ -312,6 +315,10 @@ class HyperStra_GSN_SMAOnly(IStrategy):
         # Multi SMA
         for m_timeperiod in self.sma_timeperiods:
             dataframe[f"ma_{m_timeperiod}"] = MA_Indicator(dataframe, timeperiod=m_timeperiod)
+            # Computed once here, hyperopt epochs only re-run the entry / exit trends
+            dataframe[f"ma_{m_timeperiod}{NORMALIZED_SUFFIX}"] = normalize(
+                dataframe[f"ma_{m_timeperiod}"], self.normalizer_window
+            )
 
         return dataframe
 
@@ -319,41 +326,7 @@ class HyperStra_GSN_SMAOnly(IStrategy):
         conditions = []
 
         conditions.append(
-            (
-                (dataframe["volume"] > 0)
-                & (
-                    (
-                        self.condition_maker(
-                            dataframe=dataframe,
-                            indicator=self.buy_1_indicator.value,
-                            indicator_sec=self.buy_1_indicator_sec.value,
-                            real_number=self.buy_1_real_number.value,
-                            operator=self.buy_1_operator.value,
-                            option="entry",
-                        )
-                    )
-                    & (
-                        self.condition_maker(
-                            dataframe=dataframe,
-                            indicator=self.buy_2_indicator.value,
-                            indicator_sec=self.buy_2_indicator_sec.value,
-                            real_number=self.buy_2_real_number.value,
-                            operator=self.buy_2_operator.value,
-                            option="entry",
-                        )
-                    )
-                    & (
-                        self.condition_maker(
-                            dataframe=dataframe,
-                            indicator=self.buy_3_indicator.value,
-                            indicator_sec=self.buy_3_indicator_sec.value,
-                            real_number=self.buy_3_real_number.value,
-                            operator=self.buy_3_operator.value,
-                            option="entry",
-                        )
-                    )
-                )
-            )
+            (dataframe["volume"] > 0) & all_conditions(dataframe, self.hyper_conditions("buy"))
         )
 
         if conditions:
@@ -364,110 +337,21 @@ class HyperStra_GSN_SMAOnly(IStrategy):
         conditions = []
 
         conditions.append(
-            (
-                (dataframe["volume"] > 0)
-                & (
-                    (
-                        self.condition_maker(
-                            dataframe=dataframe,
-                            indicator=self.sell_1_indicator.value,
-                            indicator_sec=self.sell_1_indicator_sec.value,
-                            real_number=self.sell_1_real_number.value,
-                            operator=self.sell_1_operator.value,
-                            option="exit",
-                        )
-                    )
-                    & (
-                        self.condition_maker(
-                            dataframe=dataframe,
-                            indicator=self.sell_2_indicator.value,
-                            indicator_sec=self.sell_2_indicator_sec.value,
-                            real_number=self.sell_2_real_number.value,
-                            operator=self.sell_2_operator.value,
-                            option="exit",
-                        )
-                    )
-                    & (
-                        self.condition_maker(
-                            dataframe=dataframe,
-                            indicator=self.sell_3_indicator.value,
-                            indicator_sec=self.sell_3_indicator_sec.value,
-                            real_number=self.sell_3_real_number.value,
-                            operator=self.sell_3_operator.value,
-                            option="exit",
-                        )
-                    )
-                )
-            )
+            (dataframe["volume"] > 0) & all_conditions(dataframe, self.hyper_conditions("sell"))
         )
 
         if conditions:
             dataframe.loc[reduce(lambda x, y: x | y, conditions), "exit_long"] = 1
         return dataframe
 
-    def condition_maker(
-        self,
-        dataframe: DataFrame,
-        indicator: int,
-        indicator_sec: int,
-        real_number: float,
-        operator: str,
-        option: str,
-    ):
-        indicator_1 = f"ma_{indicator}"
-        indicator_2 = f"ma_{indicator_sec}"
-
-        if operator == "equal":
-            return dataframe[indicator_1] == dataframe[indicator_2]
-
-        if operator == "above":
-            return dataframe[indicator_1] >= dataframe[indicator_2]
-
-        if operator == "below":
-            return dataframe[indicator_1] <= dataframe[indicator_2]
-
-        if operator == "cross_above":
-            return qtpylib.crossed_above(dataframe[indicator_1], dataframe[indicator_2])
-
-        if operator == "cross_below":
-            return qtpylib.crossed_below(dataframe[indicator_1], dataframe[indicator_2])
-
-        if operator == "divide_greater":
-            return dataframe[indicator_1].div(dataframe[indicator_2]) <= real_number
-
-        if operator == "divide_smaller":
-            return dataframe[indicator_1].div(dataframe[indicator_2]) >= real_number
-
-        if operator == "normalized_equal_n":
-            return Normalizer(dataframe[indicator_1]) == real_number
-
-        if operator == "normalized_smaller_n":
-            return Normalizer(dataframe[indicator_1]) < real_number
-
-        if operator == "normalized_bigger_n":
-            return Normalizer(dataframe[indicator_1]) > real_number
-
-        if operator == "normalized_devided_equal_n":
-            return (
-                Normalizer(dataframe[indicator_1]).div(Normalizer(dataframe[indicator_2]))
-            ) == real_number
-
-        if operator == "normalized_devided_smaller_n":
-            return (
-                Normalizer(dataframe[indicator_1]).div(Normalizer(dataframe[indicator_2]))
-            ) < real_number
-
-        if operator == "normalized_devided_bigger_n":
-            return (
-                Normalizer(dataframe[indicator_1]).div(Normalizer(dataframe[indicator_2]))
-            ) > real_number
-
-
-# ##################################################################
-# Methods
-# ##################################################################
-
-
-def Normalizer(df: DataFrame) -> DataFrame:
-    df = (df - df.min()) / (df.max() - df.min())
-    return df
+    def hyper_conditions(self, side: str) -> list:
+        # (operator, indicator, indicator_sec, real_number) of the 3 buy or sell conditions
+        return [
+            (
+                getattr(self, f"{side}_{i}_operator").value,
+                f"ma_{getattr(self, f'{side}_{i}_indicator').value}",
+                f"ma_{getattr(self, f'{side}_{i}_indicator_sec').value}",
+                getattr(self, f"{side}_{i}_real_number").value,
+            )
+            for i in (1, 2, 3)
+        ]
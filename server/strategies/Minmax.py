@@ -3,9 +3,10 @@ from freqtrade.strategy.interface import IStrategy
 from pandas import DataFrame
 # --------------------------------
 
-from scipy.signal import argrelextrema
 import numpy as np
 
+from strategy_helpers.rolling_extrema import penultimate_extrema
+
 
 class Minmax(IStrategy):
     minimal_roi = {"0": 10}
@@ -19,31 +20,19 @@ class Minmax(IStrategy):
     process_only_new_candles = False
 
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
-        dataframe_copy = dataframe.copy()
         frame_size = 500
-        len_df = len(dataframe)
-        dataframe["buy_signal"] = False
-        dataframe["exit_signal"] = False
         lookback_size = 100
-        # Let's calculate argrelextrema on separated data slices and get only last result to avoid lookahead bias!
-        for i in range(len_df):
-            if i + frame_size < len_df:
-                slice = dataframe_copy[i : i + frame_size]
-                min_peaks = argrelextrema(slice["close"].values, np.less, order=lookback_size)
-                max_peaks = argrelextrema(slice["close"].values, np.greater, order=lookback_size)
-                # Somehow we never getting last index of a frame as min or max. What a surprise :)
-                # So lets take penultimate result and use it as a signal to buy/sell.
-                if len(min_peaks[0]) and min_peaks[0][-1] == frame_size - 2:
-                    # signal that penultimate candle is min
-                    # lets buy here
-                    dataframe.at[i + frame_size, "buy_signal"] = True
-                if len(max_peaks[0]) and max_peaks[0][-1] == frame_size - 2:
-                    # oh it seams that penultimate candle is max
-                    # lets sell ASAP
-                    dataframe.at[i + frame_size, "exit_signal"] = True
-
-                if i + frame_size == len_df - 1:
-                    print(min_peaks)
+        # Only the penultimate candle of each 500 candles window can be a min or max, to avoid lookahead bias!
+        # Somehow we never getting last index of a frame as min or max. What a surprise :)
+        # So lets take penultimate result and use it as a signal to buy/sell, on the candle after the frame.
+        min_peaks, max_peaks = penultimate_extrema(dataframe["close"], lookback_size)
+        full_frame = np.arange(len(dataframe)) >= frame_size
+        # signal that penultimate candle is min
+        # lets buy here
+        dataframe["buy_signal"] = min_peaks.shift(1, fill_value=False) & full_frame
+        # oh it seams that penultimate candle is max
+        # lets sell ASAP
+        dataframe["exit_signal"] = max_peaks.shift(1, fill_value=False) & full_frame
 
         #                                                                               A
         # Wow what a pathetic results!!!Where is my Trillions of BTC?!?!?!              |
@@ -0,0 +1,75 @@
+"""
+Causal normalisation and vectorized evaluation of hyperopt operator conditions.
+"""
+import numpy as np
+from pandas import DataFrame, Series
+
+NORMALIZED_SUFFIX = "_normalized"
+
+
+def normalize(values: Series, window: int = None) -> Series:
+    """
+    Min-max scaling against the candles seen so far, or only the last `window`
+    candles, so a candle never depends on later ones. Scaling against the
+    min / max of the whole series leaks the future into backtests.
+    """
+    if window:
+        low = values.rolling(window, min_periods=1).min()
+        high = values.rolling(window, min_periods=1).max()
+    else:
+        low = values.expanding().min()
+        high = values.expanding().max()
+    return (values - low) / (high - low)
+
+
+def _crossed_above(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # qtpylib.crossed_above on arrays, the first candle never crosses
+    crossed = np.zeros(len(a), dtype=bool)
+    crossed[1:] = (a[1:] > b[1:]) & (a[:-1] <= b[:-1])
+    return crossed
+
+
+# operator -> condition on (column, column_sec, normalized column, normalized column_sec, real_number)
+OPERATORS = {
+    "equal": lambda a, b, na, nb, x: a == b,
+    "above": lambda a, b, na, nb, x: a >= b,
+    "below": lambda a, b, na, nb, x: a <= b,
+    "cross_above": lambda a, b, na, nb, x: _crossed_above(a, b),
+    "cross_below": lambda a, b, na, nb, x: _crossed_above(b, a),
+    "divide_greater": lambda a, b, na, nb, x: a / b <= x,
+    "divide_smaller": lambda a, b, na, nb, x: a / b >= x,
+    "normalized_equal_n": lambda a, b, na, nb, x: na == x,
+    "normalized_smaller_n": lambda a, b, na, nb, x: na < x,
+    "normalized_bigger_n": lambda a, b, na, nb, x: na > x,
+    "normalized_devided_equal_n": lambda a, b, na, nb, x: na / nb == x,
+    "normalized_devided_smaller_n": lambda a, b, na, nb, x: na / nb < x,
+    "normalized_devided_bigger_n": lambda a, b, na, nb, x: na / nb > x,
+}
+
+
+def all_conditions(dataframe: DataFrame, conditions: list[tuple[str, str, str, float]]) -> Series:
+    """
+    True on the candles where every (operator, column, column_sec, real_number)
+    condition holds, evaluated as one candles x conditions boolean matrix.
+    Normalized operators read the f"{column}{NORMALIZED_SUFFIX}" columns.
+    """
+    arrays = {}
+
+    def array(column: str) -> np.ndarray:
+        if column not in arrays:
+            arrays[column] = dataframe[column].to_numpy(dtype=float)
+        return arrays[column]
+
+    matrix = np.ones((len(dataframe), len(conditions)), dtype=bool)
+    # Divisions by zero give inf / nan like pandas, which compare as False
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i, (operator, column, column_sec, real_number) in enumerate(conditions):
+            normalized = operator.startswith("normalized")
+            matrix[:, i] = OPERATORS[operator](
+                array(column),
+                array(column_sec),
+                array(f"{column}{NORMALIZED_SUFFIX}") if normalized else None,
+                array(f"{column_sec}{NORMALIZED_SUFFIX}") if operator.startswith("normalized_devided") else None,
+                real_number,
+            )
+    return Series(matrix.all(axis=1), index=dataframe.index)
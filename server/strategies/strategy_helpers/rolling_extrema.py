@@ -0,0 +1,22 @@
+"""
+Lookahead-free local extrema over a sliding window, in one vectorized pass.
+"""
+from pandas import Series
+
+
+def penultimate_extrema(values: Series, order: int) -> tuple[Series, Series]:
+    """
+    Flags candle t when candle t - 1 is strictly below (minima) or above
+    (maxima) both candle t and the `order` candles before it, which is known
+    once candle t closed. Same points as argrelextrema(window, order=order)
+    reporting the penultimate candle of a window ending at t, for windows
+    longer than order + 1.
+    """
+    previous = values.shift(1)
+    # Rolling min / max are O(n) whatever the order
+    lowest = values.rolling(order, min_periods=order).min().shift(2)
+    highest = values.rolling(order, min_periods=order).max().shift(2)
+    minima = (previous < values) & (previous < lowest)
+    maxima = (previous > values) & (previous > highest)
+    return minima, maxima
+